@@ -0,0 +1,126 @@
+import asyncio
+import sys
+import threading
+from concurrent.futures import Executor
+from contextlib import aclosing
+from pathlib import Path
+from typing import AsyncGenerator, Generator, TextIO, TypeVar
+
+from . import ast
+from .converter import flatten_voices
+from .audio import AudioSettings, BLOCK
+from .tone import ToneTable
+from . import wav
+
+
+T = TypeVar("T")
+
+
+async def iterate(items: Generator[T, None, None], executor: Executor | None = None) -> AsyncGenerator[T, None]:
+    """
+    Pull `items` in `executor`, the default one of the loop if None, one ahead of the consumer.
+
+    The next item is computed while the consumer handles the current one,
+    and no further, so a slow consumer holds the producer back. Once the
+    consumer stops, cancelled or not, the item under way is left to finish
+    in the background and `items` is closed after it. The executor is to be
+    a thread pool, generators not being picklable.
+    """
+    loop = asyncio.get_running_loop()
+    # serializes pulling and closing, which may end up in different threads of the executor
+    lock = threading.Lock()
+    done = object()
+
+    def pull() -> T | object:
+        with lock:
+            return next(items, done)
+
+    def close() -> None:
+        with lock:
+            items.close()
+
+    pending = loop.run_in_executor(executor, pull)
+    try:
+        while (item := await pending) is not done:
+            pending = loop.run_in_executor(executor, pull)
+            yield item  # type: ignore
+    finally:
+        # what becomes of an item no one waits for any more is of no interest
+        pending.add_done_callback(lambda future: future.cancelled() or future.exception())
+        try:
+            loop.run_in_executor(executor, close)
+        except RuntimeError:
+            # the executor is shut down, so nothing pulls from `items` any more
+            close()
+
+
+async def convert_async(music: ast.Music, executor: Executor | None = None, output: TextIO = sys.stderr) -> list[ToneTable]:
+    """`converter.flatten_voices` in `executor`."""
+    return await asyncio.get_running_loop().run_in_executor(executor, flatten_voices, music, output)
+
+
+async def render_async(music: ast.Music, settings: AudioSettings, executor: Executor | None = None, frames: int = BLOCK, output: TextIO = sys.stderr) -> AsyncGenerator[bytes, None]:
+    """
+    Render `music` as PCM blocks of `frames` frames, synthesized in `executor`.
+
+    Blocks are the same as those `settings.stream` yields, or `stream_mix`
+    for several voices, and are synthesized only as they are consumed, see
+    `iterate`. Cancelling the consumer stops the render after the block
+    under way.
+    """
+    voices = await convert_async(music, executor, output)
+    async with aclosing(render_voices_async(voices, settings, executor, frames)) as blocks:
+        async for block in blocks:
+            yield block
+
+
+async def render_voices_async(voices: list[ToneTable], settings: AudioSettings, executor: Executor | None = None, frames: int = BLOCK) -> AsyncGenerator[bytes, None]:
+    """Same as `render_async`, on voices converted already."""
+    pcm = settings.stream_mix(voices, frames) if len(voices) > 1 else settings.stream(voices[0], frames)
+    async with aclosing(iterate(pcm, executor)) as blocks:
+        async for block in blocks:
+            yield block
+
+
+async def wav_async(music: ast.Music, settings: AudioSettings, executor: Executor | None = None, output: TextIO = sys.stderr) -> AsyncGenerator[bytes, None]:
+    """The WAV file of `music`, its header first, then the blocks of `render_async`."""
+    voices = await convert_async(music, executor, output)
+    yield wav.header(settings.sr, settings.sw, settings.count_frames(voices))
+    async with aclosing(render_voices_async(voices, settings, executor)) as blocks:
+        async for block in blocks:
+            yield block
+
+
+async def write_async(blocks: AsyncGenerator[bytes, None], writer: asyncio.StreamWriter) -> int:
+    """
+    Write `blocks` to `writer`, a socket or pipe, waiting for each to be taken before asking for the next.
+
+    Returns the number of bytes written. `blocks` is closed once done, even
+    if the other end goes away.
+    """
+    size = 0
+    async with aclosing(blocks):
+        async for block in blocks:
+            writer.write(block)
+            await writer.drain()
+            size += len(block)
+    return size
+
+
+async def save_async(music: ast.Music, settings: AudioSettings, output: Path, executor: Executor | None = None, log: TextIO = sys.stderr) -> None:
+    """
+    Save `music` as a WAV file, the same as `settings.save` would, synthesizing and writing in `executor`.
+
+    The file is removed if the render fails or is cancelled.
+    """
+    loop = asyncio.get_running_loop()
+    file = await loop.run_in_executor(executor, output.open, "wb")
+    try:
+        async with aclosing(wav_async(music, settings, executor, log)) as blocks:
+            async for block in blocks:
+                await loop.run_in_executor(executor, file.write, block)
+    except BaseException:
+        file.close()
+        output.unlink(missing_ok=True)
+        raise
+    file.close()
@@ -6,10 +6,18 @@ Solfa = Literal["1", "2", "3", "4", "5", "6", "7"]
 Alpha = Literal["C", "D", "E", "F", "G", "A", "B"]
 
 
+# Music and its groups are built up as the score is parsed. Everything below
+# them is immutable, and interned by the parser: within a score, identical
+# passages, measures and notes are the very same objects, so that repeated
+# content takes no more memory, and the converter can tell repeats by identity.
+
+
 @dataclass
 class Music:
     groups: "list[Group]"
     final: "list[int] | None"
+    # final orders of the voices played along with the first one
+    voices: "list[list[int]]"
 
 
 @dataclass
@@ -20,33 +28,33 @@ class Group:
     passages: "list[Passage]"
 
 
-@dataclass
+@dataclass(frozen=True)
 class Passage:
-    measures: "list[Measure]"
+    measures: "tuple[Measure, ...]"
 
 
-@dataclass
+@dataclass(frozen=True)
 class Measure:
-    elements: "list[Element]"
+    elements: "tuple[Element, ...]"
 
 
-@dataclass
+@dataclass(frozen=True)
 class TimedNote:
     note: "Note"
     time: "Time"
 
 
-@dataclass
+@dataclass(frozen=True)
 class Braced:
-    inners: "list[Element]"
+    inners: "tuple[Element, ...]"
 
 
-@dataclass
+@dataclass(frozen=True)
 class Angled:
-    inners: "list[Element]"
+    inners: "tuple[Element, ...]"
 
 
-@dataclass
+@dataclass(frozen=True)
 class Rated:
     ratio: "Ratio"
     inner: "Element"
@@ -55,23 +63,23 @@ class Rated:
 Element = TimedNote | Braced | Angled | Rated
 
 
-@dataclass
+@dataclass(frozen=True)
 class Ratio:
     n: "int"
     d: "int | None"
 
 
-@dataclass
+@dataclass(frozen=True)
 class Rest:
     pass
 
 
-@dataclass
+@dataclass(frozen=True)
 class Tied:
     pass
 
 
-@dataclass
+@dataclass(frozen=True)
 class SAO:
     solfa: "Solfa"
     accid: "int | None"
@@ -81,26 +89,26 @@ class SAO:
 Note = Rest | Tied | SAO
 
 
-@dataclass
+@dataclass(frozen=True)
 class AAO:
     alpha: "Alpha"
     accid: "int | None"
     octav: "int"
 
 
-@dataclass
+@dataclass(frozen=True)
 class Mode:
     sao: "SAO"
     aao: "AAO"
 
 
-@dataclass
+@dataclass(frozen=True)
 class Metre:
     n: "int"
     d: "int"
 
 
-@dataclass
+@dataclass(frozen=True)
 class Time:
     und: "int"
     dot: "int"
@@ -1,30 +1,49 @@
 import sys
-import wave
+import math
+from fractions import Fraction
 from dataclasses import dataclass
-from typing import Callable, TextIO
+from typing import Any, BinaryIO, Callable, Iterable, Iterator, Sequence, TextIO
 from pathlib import Path
 
 import numpy as np
 
-from .tone import Tone
+from .tone import Tone, ToneTable, ToneView
 from .piano import Piano
+from .oscillator import Bank, Oscillator
+from .cache import Key, WaveCache
+from . import stats, wav
+from .playback import Opener, Player, open_stream
 
 
-Func = Callable[[np.ndarray, float], np.ndarray]
+# The frequency is either a scalar or an array holding one value per sample
+Func = Callable[[np.ndarray, np.ndarray | float], np.ndarray]
+
+
+BLOCK = 4096
+
+# Voices are mixed in larger blocks, to keep the number of batches down with many voices
+MIX_BLOCK = 16 * BLOCK
+
+# Playback is fed in smaller blocks, so that the piano follows the notes closely
+PLAY_BLOCK = 1024
 
 
 FUNCS: dict[str, Func] = {
     "sn": lambda t, freq: np.sin(2 * np.pi * freq * t),
     "pl": lambda t, freq, delta=5.0: np.sin(2 * np.pi * (freq - delta / 2) * t) / 3 - np.sin(2 * np.pi * (freq + delta / 2) * t) / 3 * 2,
-    "sq": lambda t, freq, n=8: np.sum([np.sin(2 * np.pi * (2 * i + 1) * freq * t) / (2 * i + 1) for i in range(n)], 0) * 4 / np.pi,
-    "tr": lambda t, freq, n=8: np.sum([np.sin(2 * np.pi * (2 * i + 1) * freq * t) / (2 * i + 1) ** 2 * (-1) ** i for i in range(n)], 0) * 8 / np.pi**2,
-    "st": lambda t, freq, n=8: np.sum([np.sin(2 * np.pi * (i + 1) * freq * t) / (i + 1) for i in range(n)], 0) * 2 / np.pi,
+    "sq": lambda t, freq, i=np.arange(8)[:, None]: np.sum(np.sin(2 * np.pi * (2 * i + 1) * freq * t) / (2 * i + 1), 0) * 4 / np.pi,
+    "tr": lambda t, freq, i=np.arange(8)[:, None]: np.sum(np.sin(2 * np.pi * (2 * i + 1) * freq * t) / (2 * i + 1) ** 2 * (-1) ** i, 0) * 8 / np.pi**2,
+    "st": lambda t, freq, i=np.arange(8)[:, None]: np.sum(np.sin(2 * np.pi * (i + 1) * freq * t) / (i + 1), 0) * 2 / np.pi,
     # 'sq': lambda t, freq: np.sign(np.sin(2 * np.pi * freq * t)),
     # 'tr': lambda t, freq: np.fabs(np.fmod(freq * t + 0.75, 1.0) * 4.0 - 2.0) - 1.0,
     # 'st': lambda t, freq: np.fabs(np.fmod(freq * t + 0.50, 1.0) * 2.0 - 0.0) - 1.0,
 }
 
 
+def timbre(func: Func) -> str | None:
+    return next((key for key, value in FUNCS.items() if value is func), None)
+
+
 @dataclass
 class AudioSettings:
     func: Func
@@ -33,35 +52,302 @@ class AudioSettings:
     volume: float
     sr: int
     sw: int
+    bank: Bank | None = None
+    cache: WaveCache | None = None
+
+    def gen_batch(self, secs: np.ndarray, freq: np.ndarray, size: np.ndarray, start: np.ndarray, stop: np.ndarray, osc: Oscillator | None = None) -> np.ndarray:
+        """
+        Synthesize several pieces of tones at once, back to back.
+
+        Piece `i` is made of frames `start[i]` to `stop[i]` of a tone of `size[i]`
+        frames, lasting `secs[i]` seconds at frequency `freq[i]`. The time axes
+        are those of `np.linspace` over each whole tone, evaluated for the
+        requested frames only, so a tone rendered piece by piece, alone or
+        together with others, is identical to one rendered at once.
+
+        With a wavetable bank, the waveform comes from `osc` instead of `func`,
+        and its phase runs on from the previous batch rendered by `osc`.
+        """
+        step = np.array([s / (n - 1) if n > 1 else 0.0 for s, n in zip(secs.tolist(), size.tolist())])
+        count = stop - start
+        end = np.cumsum(count)
+        frames = np.arange(end[-1] if len(end) else 0, dtype=np.float64)
+        frames += np.repeat(start - (end - count), count)
+        fw = frames * np.repeat(step, count)
+        bw = frames * np.repeat(-step, count)
+        bw += np.repeat(secs, count)
+        last = (stop == size) & (size > 1)
+        fw[end[last] - 1] = secs[last]
+        bw[end[last] - 1] = 0.0
+        if self.bank is None:
+            data = self.func(fw, np.repeat(freq, count))
+        else:
+            data = (osc or Oscillator(self.bank)).render(freq, count, self.sr)
+        fw /= self.attack
+        bw /= self.decay
+        data *= np.fmin(np.fmin(fw, bw, out=fw), 1.0, out=fw)
+        data *= self.volume
+        return data
 
-    def gen_wave(self, tone: Tone) -> bytes:
-        fw = np.linspace(0, tone.secs, int(self.sr * tone.secs))
-        bw = np.linspace(tone.secs, 0, int(self.sr * tone.secs))
-        freq = 440.0 * 2 ** (tone.pitch / 12) if tone.pitch is not None else 0.0
-        data = self.func(fw, freq) * np.fmin(np.fmin(fw / self.attack, bw / self.decay), 1.0) * self.volume
+    def quantize(self, data: np.ndarray) -> bytes:
         return (np.int16(data * 32767) if self.sw == 2 else np.uint8(data * 127 + 128)).tobytes()
 
-    def save(self, tones: list[Tone], output: Path) -> None:
-        with wave.open(output.as_posix(), "wb") as file:
-            file.setnchannels(1)
-            file.setsampwidth(self.sw)
-            file.setframerate(self.sr)
-            for tone in tones:
-                file.writeframes(self.gen_wave(tone))
-
-    def play(self, tones: list[Tone], output: TextIO = sys.stdout):
-        try:
-            from pyaudio import PyAudio  # type: ignore
-        except ImportError:
-            print("pyaudio is not installed; cannot play audio.", file=sys.stderr)
+    def quantize_into(self, data: np.ndarray, out: np.ndarray) -> None:
+        """Same as `quantize`, into the bytes of `out` rather than new ones, a block at a time."""
+        for start in range(0, len(data), MIX_BLOCK):
+            chunk = data[start : start + MIX_BLOCK]
+            if self.sw == 2:
+                out[start * 2 : (start + MIX_BLOCK) * 2].view("<i2")[:] = chunk * 32767
+            else:
+                out[start : start + MIX_BLOCK] = chunk * 127 + 128
+
+    def describe(self) -> dict[str, Any]:
+        """What sets apart the stages of synthesis in `stats`."""
+        return {"timbre": timbre(self.func) or "custom", "wavetable": self.bank is not None}
+
+    def key(self, tone: Tone | ToneView, frames: int) -> Key | None:
+        """Key of the waveform of `tone` in a cache, if it does not depend on what was played before."""
+        name = timbre(self.func)
+        if name is None or self.bank is not None:
+            return None
+        return name, tone.pitch, tone.secs, frames, self.attack, self.decay, self.volume, self.sr, self.sw
+
+    def gen_wave(self, tone: Tone | ToneView, frames: int | None = None) -> bytes:
+        if frames is None:
+            frames = math.floor(tone.secs * self.sr)
+        key = self.key(tone, frames) if self.cache is not None else None
+        if key is not None:
+            assert self.cache is not None
+            data = self.cache.get(key)
+            if data is not None:
+                return data
+        table = ToneTable.from_tones([tone])
+        size = np.array([frames])
+        data = self.quantize(self.gen_batch(table.secs, table.freq, size, np.zeros(1, dtype=np.int64), size))
+        if key is not None:
+            assert self.cache is not None
+            self.cache.put(key, data)
+        return data
+
+    def stream(self, tones: Iterable[Tone] | ToneTable, frames: int = BLOCK, onset: Fraction = Fraction(0)) -> Iterator[bytes]:
+        """
+        Render `tones` as PCM blocks of `frames` frames, the last one possibly shorter.
+
+        Tones start at `onset` seconds, and each of them spans the frames from
+        that of its onset to that of the next one, as given by `ToneTable.edges`.
+        They are pulled from `tones` a table at a time only as the blocks are
+        consumed, and every block is synthesized in one batch from the pieces of
+        the tones it spans, so memory use does not depend on the length of the
+        score or its notes.
+
+        With a cache, tones are rendered whole by `gen_wave` instead, and cut
+        into the very same blocks.
+        """
+        if self.cache is not None and self.bank is None and timbre(self.func) is not None:
+            size = frames * self.sw
+            pending = bytearray()
+            for table in ToneTable.batches(tones):
+                totals = np.diff(table.edges(self.sr, onset)).tolist()
+                onset += table.total()
+                for tone, total in zip(table, totals):
+                    data = self.gen_wave(tone, total)
+                    start = min(size - len(pending), len(data)) if pending else 0
+                    pending += data[:start]
+                    if len(pending) == size:
+                        yield bytes(pending)
+                        pending.clear()
+                    while start + size <= len(data):
+                        yield data[start : start + size]
+                        start += size
+                    pending += data[start:]
+            if pending:
+                yield bytes(pending)
             return
-        pa = PyAudio()
-        stream = pa.open(format=pa.get_format_from_width(self.sw), channels=1, rate=self.sr, output=True)
-        with Piano(output) as gui:
-            for tone in tones:
-                gui.show(tone.pitch)
-                stream.write(self.gen_wave(tone))
-                gui.show(None)
-        stream.stop_stream()
-        stream.close()
-        pa.terminate()
+        for data in self.blocks(tones, frames, onset):
+            yield self.quantize(data)
+
+    def blocks(self, tones: Iterable[Tone] | ToneTable, frames: int = BLOCK, onset: Fraction = Fraction(0)) -> Iterator[np.ndarray]:
+        """Samples of the blocks of `stream`, before quantization, always synthesized in batches."""
+        osc = Oscillator(self.bank) if self.bank is not None else None
+        # the tones not rendered completely yet, with the frames they end at, and the frames rendered so far
+        secs = np.empty(0)
+        freq = np.empty(0)
+        ends = np.empty(0, dtype=np.int64)
+        sizes = np.empty(0, dtype=np.int64)
+        done = 0
+        for table in ToneTable.batches(tones):
+            edges = table.edges(self.sr, onset)
+            onset += table.total()
+            secs = np.concatenate((secs, table.secs))
+            freq = np.concatenate((freq, table.freq))
+            ends = np.concatenate((ends, edges[1:] + (ends[-1] if len(ends) else 0)))
+            sizes = np.concatenate((sizes, np.diff(edges)))
+            while len(ends) and ends[-1] - done >= frames:
+                yield self.gen_block(secs, freq, ends, sizes, done, done + frames, osc)
+                done += frames
+            k = int(np.searchsorted(ends, done, side="right"))
+            if k:
+                shift = ends[k - 1]
+                secs, freq, ends, sizes = secs[k:], freq[k:], ends[k:] - shift, sizes[k:]
+                done -= shift
+        if len(ends) and ends[-1] > done:
+            yield self.gen_block(secs, freq, ends, sizes, done, ends[-1], osc)
+
+    def gen_block(self, secs: np.ndarray, freq: np.ndarray, ends: np.ndarray, sizes: np.ndarray, lo: int, hi: int, osc: Oscillator | None) -> np.ndarray:
+        """Render frames `lo` to `hi` of tones lying back to back, ending at `ends`."""
+        starts = ends - sizes
+        i = np.searchsorted(ends, lo, side="right")
+        j = np.searchsorted(starts, hi, side="left")
+        starts = starts[i:j]
+        start = np.maximum(starts, lo) - starts
+        stop = np.minimum(ends[i:j], hi) - starts
+        return self.gen_batch(secs[i:j], freq[i:j], sizes[i:j], start, stop, osc)
+
+    def mix(self, voices: Sequence[ToneTable], frames: int = MIX_BLOCK) -> np.ndarray:
+        """
+        Mix `voices`, all starting at once, into a single buffer.
+
+        Every voice is synthesized a block at a time and added onto the buffer
+        at the exact frames of the block. If the sum goes beyond full scale, the
+        whole buffer is scaled down to fit, rather than clipped, so the relative
+        levels of the voices are kept.
+        """
+        buffer = np.zeros(self.count_frames(voices), dtype=np.float32)
+        for tones in voices:
+            done = 0
+            for data in self.blocks(tones, frames):
+                buffer[done : done + len(data)] += data
+                done += len(data)
+        peak = float(np.abs(buffer).max()) if len(buffer) else 0.0
+        if peak > 1.0:
+            buffer *= np.float32(1.0 / peak)
+        return buffer
+
+    def count_frames(self, voices: Sequence[ToneTable]) -> int:
+        """Number of frames of `voices` played all at once, as mixed by `mix`."""
+        return max((int(tones.edges(self.sr)[-1]) for tones in voices), default=0)
+
+    def stream_mix(self, voices: Sequence[ToneTable], frames: int = BLOCK) -> Iterator[bytes]:
+        buffer = self.mix(voices)
+        for start in range(0, len(buffer), frames):
+            yield self.quantize(buffer[start : start + frames])
+
+    def render_into(self, tones: ToneTable, out: np.ndarray, onset: Fraction = Fraction(0)) -> None:
+        """Render `tones` into `out`, as many bytes as their frames, just as `stream` would."""
+        if self.cache is not None and self.bank is None and timbre(self.func) is not None:
+            edges = (tones.edges(self.sr, onset) * self.sw).tolist()
+            with stats.stage("synthesize", **self.describe(), cached=True):
+                for tone, start, stop in zip(tones, edges[:-1], edges[1:]):
+                    out[start:stop] = np.frombuffer(self.gen_wave(tone, (stop - start) // self.sw), dtype=np.uint8)
+            return
+        done = 0
+        for data in stats.timed("synthesize", self.blocks(tones, BLOCK, onset), **self.describe()):
+            with stats.stage("quantize", sw=self.sw):
+                self.quantize_into(data, out[done : done + len(data) * self.sw])
+            done += len(data) * self.sw
+
+    def save(self, tones: Iterable[Tone] | ToneTable, output: Path) -> None:
+        """Save `tones` as a WAV file, allocated whole up front and filled in through a memory map."""
+        if not isinstance(tones, ToneTable):
+            with stats.stage("flatten"):
+                tones = ToneTable.from_tones(tones)
+        frames = int(tones.edges(self.sr)[-1])
+        stats.count("frames", frames)
+        with wav.create(output, self.sr, self.sw, frames) as out:
+            self.render_into(tones, out)
+
+    def save_stream(self, tones: Iterable[Tone] | ToneTable, output: Path) -> None:
+        """Save `tones` as a WAV file, written as they are synthesized, without knowing how many there are beforehand."""
+        with wav.stream(output, self.sr, self.sw) as file:
+            for block in stats.timed("synthesize", self.stream(tones), **self.describe()):
+                with stats.stage("write"):
+                    file.write(block)
+                stats.count("frames", len(block) // self.sw)
+
+    def write_pcm(self, tones: Iterable[Tone] | ToneTable, file: BinaryIO) -> None:
+        """
+        Write the samples of `tones` to `file` as they are synthesized, with no header, for a pipe to take them as they come.
+
+        Blocks are quantized into a single buffer, written through a memory
+        view of it rather than copied into bytes, and tones from the cache are
+        written whole, as they are. `file` is to write all it is given, as
+        buffered files do.
+        """
+        if self.cache is not None and self.bank is None and timbre(self.func) is not None:
+            onset = Fraction(0)
+            for table in ToneTable.batches(tones):
+                totals = np.diff(table.edges(self.sr, onset)).tolist()
+                onset += table.total()
+                for tone, total in zip(table, totals):
+                    data = self.gen_wave(tone, total)
+                    with stats.stage("write"):
+                        file.write(data)
+                    stats.count("frames", total)
+            return
+        out = np.empty(BLOCK * self.sw, dtype=np.uint8)
+        view = memoryview(out)
+        for data in stats.timed("synthesize", self.blocks(tones), **self.describe()):
+            size = len(data) * self.sw
+            self.quantize_into(data, out[:size])
+            with stats.stage("write"):
+                file.write(view[:size])
+            stats.count("frames", len(data))
+
+    def write_mix_pcm(self, voices: Sequence[ToneTable], file: BinaryIO) -> None:
+        """Same as `write_pcm`, for `voices` mixed by `mix`."""
+        with stats.stage("mix", **self.describe(), voices=len(voices)):
+            buffer = self.mix(voices)
+        out = np.empty(MIX_BLOCK * self.sw, dtype=np.uint8)
+        view = memoryview(out)
+        for start in range(0, len(buffer), MIX_BLOCK):
+            chunk = buffer[start : start + MIX_BLOCK]
+            size = len(chunk) * self.sw
+            self.quantize_into(chunk, out[:size])
+            with stats.stage("write"):
+                file.write(view[:size])
+        stats.count("frames", len(buffer))
+
+    def write_wav(self, voices: Sequence[ToneTable], file: BinaryIO) -> None:
+        """Write `voices` to `file` as a WAV file, as they are synthesized, its header first, sizes and all, so that it never needs to be seeked."""
+        file.write(wav.header(self.sr, self.sw, self.count_frames(voices)))
+        if len(voices) > 1:
+            self.write_mix_pcm(voices, file)
+        else:
+            self.write_pcm(voices[0], file)
+
+    def save_mix(self, voices: Sequence[ToneTable], output: Path) -> None:
+        with stats.stage("mix", **self.describe(), voices=len(voices)):
+            buffer = self.mix(voices)
+        stats.count("frames", len(buffer))
+        with wav.create(output, self.sr, self.sw, len(buffer)) as out, stats.stage("quantize", sw=self.sw):
+            self.quantize_into(buffer, out)
+
+    def play(self, tones: Iterable[Tone] | ToneTable, output: TextIO = sys.stdout, latency: float = 0.2, opener: Opener = open_stream) -> Player | None:
+        """Play `tones` through the stream of `opener`, synthesized up to `latency` seconds ahead, and return the player once done."""
+        tones = tones if isinstance(tones, ToneTable) else ToneTable.from_tones(tones)
+        edges = tones.edges(self.sr)
+        player = Player(stats.timed("synthesize", self.stream(tones, PLAY_BLOCK), **self.describe()), self.sr, self.sw, latency, PLAY_BLOCK)
+        with opener(self.sr, self.sw, player.frames, player.callback) as stream:
+            if stream is None:
+                return None
+            with Piano(output) as gui:
+                shown = -1
+
+                def tick(played: int) -> None:
+                    nonlocal shown
+                    index = int(np.searchsorted(edges, played, side="right")) - 1
+                    if index != shown and index < len(tones):
+                        gui.show(tones[index].pitch)
+                        shown = index
+
+                player.run(stream, tick)
+        return player
+
+    def play_mix(self, voices: Sequence[ToneTable], latency: float = 0.2, opener: Opener = open_stream) -> Player | None:
+        # the piano shows a single key at a time, so it is left out with several voices
+        player = Player(stats.timed("mix", self.stream_mix(voices, PLAY_BLOCK), **self.describe(), voices=len(voices)), self.sr, self.sw, latency, PLAY_BLOCK)
+        with opener(self.sr, self.sw, player.frames, player.callback) as stream:
+            if stream is None:
+                return None
+            player.run(stream)
+        return player
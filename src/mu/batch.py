@@ -0,0 +1,159 @@
+import argparse
+import glob
+import io
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, replace
+from pathlib import Path
+from typing import TextIO
+
+from .parser import TextSource, TextBuffer, ParserError, parse_music
+from .converter import flatten_voices
+from .audio import AudioSettings, FUNCS, timbre
+from .compiled import load_fresh
+from .options import add_audio_arguments, audio_settings
+
+
+@dataclass
+class Outcome:
+    path: Path
+    output: Path
+    secs: float = 0.0
+    warnings: str = ""
+    error: str | None = None
+
+
+# settings of the worker process, set up once by `init` and kept from one score to the next
+settings: AudioSettings | None = None
+
+
+def init(key: str, portable: AudioSettings) -> None:
+    global settings
+    settings = replace(portable, func=FUNCS[key])
+
+
+def render(path: Path, output: Path) -> Outcome:
+    """
+    Save the score at `path` into `output` with the settings of this worker, as `mu` would.
+
+    Whatever goes wrong is reported in the outcome, so that one score
+    failing leaves the others to be rendered.
+    """
+    assert settings is not None
+    log = io.StringIO()
+    try:
+        precompiled = load_fresh(path)
+        if precompiled is not None:
+            voices = precompiled.voices(log)
+        else:
+            voices = flatten_voices(parse_music(TextBuffer(TextSource(name=path.name, text=path.read_text(encoding="utf-8")))), log)
+        if len(voices) > 1:
+            settings.save_mix(voices, output)
+        else:
+            settings.save(voices[0], output)
+    except ParserError as e:
+        return Outcome(path, output, warnings=log.getvalue(), error=str(e))
+    except Exception as e:
+        return Outcome(path, output, warnings=log.getvalue(), error=f"{type(e).__name__}: {e}")
+    return Outcome(path, output, secs=float(max(tones.total() for tones in voices)), warnings=log.getvalue())
+
+
+def expand(patterns: list[str]) -> list[Path]:
+    """Scores named by `patterns`, each a file, a directory of scores or a glob pattern, without duplicates."""
+    paths: dict[Path, None] = {}
+    for pattern in patterns:
+        path = Path(pattern)
+        if path.is_dir():
+            found = sorted(path.glob("*.μ"))
+        elif any(c in pattern for c in "*?["):
+            found = sorted(Path(name) for name in glob.glob(pattern))
+        else:
+            found = [path]
+        paths.update(dict.fromkeys(found))
+    return list(paths)
+
+
+def up_to_date(path: Path, output: Path) -> bool:
+    return output.exists() and output.stat().st_mtime_ns >= path.stat().st_mtime_ns
+
+
+def batch(settings: AudioSettings, paths: list[Path], directory: Path, jobs: int, force: bool = False, log: TextIO = sys.stderr) -> list[Outcome]:
+    """
+    Save every score of `paths` into `directory`, spread over `jobs` processes.
+
+    Each worker sets up its settings once, cache included, and renders scores
+    one after the other, so the interpreter and the timbre tables are paid for
+    once per worker rather than once per score. Scores whose output is newer
+    than themselves are skipped unless `force`d. Returns the outcomes of those
+    rendered, in the order they finished.
+    """
+    key = timbre(settings.func)
+    if key is None:
+        raise ValueError("only the timbres of FUNCS can be rendered in batch")
+    directory.mkdir(parents=True, exist_ok=True)
+    tasks = list[tuple[Path, Path]]()
+    for path in paths:
+        output = directory / (path.stem + ".wav")
+        if not force and path.exists() and up_to_date(path, output):
+            log.write(f"{path}: up to date\n")
+        else:
+            tasks.append((path, output))
+    portable = replace(settings, func=None)
+    outcomes = list[Outcome]()
+
+    def report(outcome: Outcome) -> None:
+        for line in outcome.warnings.splitlines():
+            log.write(f"{outcome.path}: {line}\n")
+        if outcome.error is not None:
+            log.write(f"{outcome.path}: Error: {outcome.error}\n")
+        else:
+            log.write(f"{outcome.path} -> {outcome.output}\n")
+        outcomes.append(outcome)
+
+    if jobs == 1 or len(tasks) <= 1:
+        init(key, portable)
+        for path, output in tasks:
+            report(render(path, output))
+    else:
+        with ProcessPoolExecutor(max_workers=min(jobs, len(tasks)), initializer=init, initargs=(key, portable)) as pool:
+            futures = {pool.submit(render, path, output): (path, output) for path, output in tasks}
+            for future in as_completed(futures):
+                try:
+                    outcome = future.result()
+                except Exception as e:
+                    # the worker itself died, out of memory say
+                    outcome = Outcome(*futures[future], error=f"{type(e).__name__}: {e}")
+                report(outcome)
+    return outcomes
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(prog="mu batch", description="Save many scores to wav files at once, in a pool of processes")
+    parser.add_argument("scores", type=str, nargs="+", help="score files, directories of scores or glob patterns of score files")
+    parser.add_argument("-o", "--output-dir", type=Path, default=Path("."), help="directory to save the wav files in, named after the scores")
+    add_audio_arguments(parser)
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, help="number of processes to render scores with")
+    parser.add_argument("-f", "--force", action="store_true", help="render scores again even if their output is up to date")
+    args = parser.parse_args(argv)
+    if args.jobs < 1:
+        parser.error("the number of jobs must be at least 1")
+    paths = expand(args.scores)
+    if not paths:
+        parser.error("no score to render")
+    begin = time.perf_counter()
+    outcomes = batch(audio_settings(args), paths, args.output_dir, args.jobs, args.force)
+    elapsed = time.perf_counter() - begin
+    done = [outcome for outcome in outcomes if outcome.error is None]
+    failed = [outcome for outcome in outcomes if outcome.error is not None]
+    secs = sum(outcome.secs for outcome in done)
+    print(
+        f"Rendered {len(done)} scores, {secs:.1f} s of sound in {elapsed:.1f} s ({secs / elapsed:.1f}x real time), "
+        f"{len(paths) - len(outcomes)} up to date, {len(failed)} failed",
+        file=sys.stderr,
+    )
+    for outcome in failed:
+        print(f"  {outcome.path}: {outcome.error}", file=sys.stderr)
+    if failed:
+        sys.exit(1)
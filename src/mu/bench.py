@@ -0,0 +1,193 @@
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import platform
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import wave
+from fractions import Fraction
+from pathlib import Path
+from typing import Any, Callable, TextIO
+
+import numpy as np
+
+from .parser import TextSource, TextBuffer, parse_music
+from .converter import flatten
+from .audio import AudioSettings, FUNCS, BLOCK
+from .oscillator import BANKS, Oscillator
+from .tone import ToneTable
+from .stats import peak_rss
+
+
+# The last bar line of a score, followed by its final order if any
+FINAL = re.compile(r"\|\s*(?::[\s\d]*|\|)\s*$")
+
+
+def time_per_sample(fn, samples: int, repeat: int = 5, number: int = 50) -> float:
+    """Best time of `fn` over `repeat` rounds of `number` calls, in nanoseconds per sample."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        best = min(best, (time.perf_counter() - start) / number)
+    return best * 1e9 / samples
+
+
+def bench_oscillators(sr: int = 44100) -> dict[str, dict[str, float]]:
+    """Compare the lambdas of `FUNCS` to the wavetable oscillators, on a block of short notes, in nanoseconds per sample."""
+    rng = np.random.default_rng(0)
+    freq = 440.0 * 2 ** (rng.integers(-24, 12, 16) / 12)
+    count = np.full(16, BLOCK // 16)
+    t = np.arange(BLOCK) / sr
+    f = np.repeat(freq, count)
+    results: dict[str, dict[str, float]] = {}
+    for name, func in FUNCS.items():
+        osc = Oscillator(BANKS[name])
+        results[name] = {
+            "lambda": time_per_sample(lambda: func(t, f), BLOCK),
+            "wavetable": time_per_sample(lambda: osc.render(freq, count, sr), BLOCK),
+        }
+    return results
+
+
+def bench_startup(repeat: int = 5) -> dict[str, dict[str, Any]]:
+    """
+    Time the imports of the modules `mu` starts with, in fresh interpreters, in milliseconds.
+
+    `mu.cli` and `mu.check` are to be imported without NumPy, which only the
+    commands that synthesize sound need, so that checking scores stays quick.
+    """
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join([str(Path(__file__).resolve().parents[1]), os.environ.get("PYTHONPATH", "")])}
+    results: dict[str, dict[str, Any]] = {}
+    for module in "mu.cli", "mu.check", "mu.audio":
+        times = []
+        for _ in range(repeat):
+            run = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import sys, {module}; print('numpy' in sys.modules)"], env=env, capture_output=True, text=True, check=True)
+            line = next(line for line in run.stderr.splitlines() if line.endswith(f"| {module}"))
+            times.append(int(line.split("|")[1]) / 1000)
+        results[module] = {"import_ms": min(times), "numpy": run.stdout.strip() == "True"}
+    return results
+
+
+def scale(text: str, factor: int) -> str:
+    """A score made of `factor` copies of all the groups of `text`, played in order."""
+    body = FINAL.sub("|", text.rstrip())
+    return ";\n".join([body] * factor) + "|\n"
+
+
+def best(fn: Callable[[], Any], repeat: int) -> tuple[float, Any]:
+    """Best time of `fn` over at most `repeat` runs, stopping early once a run takes over a second, along with its result."""
+    secs = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        secs = min(secs, time.perf_counter() - start)
+        if secs > 1.0:
+            break
+    return secs, result
+
+
+def run_frontend(name: str, text: str, factor: int, repeat: int) -> list[dict[str, Any]]:
+    """Time the parser and the converter on `text` scaled `factor` times."""
+    text = scale(text, factor) if factor > 1 else text
+    source = TextSource(name=name, text=text)
+    parse_secs, music = best(lambda: parse_music(TextBuffer(source), pause_gc=True), repeat)
+    flatten_secs, tones = best(lambda: flatten(music, io.StringIO()), repeat)
+    notes = len(tones)
+    common = {"score": name, "scale": factor, "chars": len(text), "notes": notes}
+    return [
+        {**common, "stage": "parse", "secs": parse_secs, "notes_per_sec": notes / parse_secs, "peak_rss_mib": peak_rss()},
+        {**common, "stage": "flatten", "secs": flatten_secs, "notes_per_sec": notes / flatten_secs, "peak_rss_mib": peak_rss()},
+    ]
+
+
+def run_backend(name: str, text: str, timbre: str, sw: int, sr: int, limit: Fraction, repeat: int) -> list[dict[str, Any]]:
+    """Time synthesis and WAV writing of the first `limit` seconds of `text`."""
+    tones = flatten(parse_music(TextBuffer(TextSource(name=name, text=text))), io.StringIO())
+    total = Fraction(0)
+    count = 0
+    while count < len(tones) and total < limit:
+        total += tones[count].secs
+        count += 1
+    tones = tones[:count]
+    assert isinstance(tones, ToneTable)
+    settings = AudioSettings(func=FUNCS[timbre], attack=0.02, decay=0.02, volume=0.8, sr=sr, sw=sw)
+    synth_secs, blocks = best(lambda: list(settings.stream(tones)), repeat)
+    samples = sum(map(len, blocks)) // sw
+
+    def write() -> None:
+        with tempfile.TemporaryFile() as temp, wave.open(temp, "wb") as file:
+            file.setnchannels(1)
+            file.setsampwidth(sw)
+            file.setframerate(sr)
+            for block in blocks:
+                file.writeframes(block)
+
+    write_secs, _ = best(write, repeat)
+    common = {"score": name, "scale": 1, "timbre": timbre, "sw": sw, "sr": sr, "notes": len(tones), "samples": samples}
+    return [
+        {**common, "stage": "synth", "secs": synth_secs, "notes_per_sec": len(tones) / synth_secs, "samples_per_sec": samples / synth_secs, "peak_rss_mib": peak_rss()},
+        {**common, "stage": "write", "secs": write_secs, "samples_per_sec": samples / write_secs, "peak_rss_mib": peak_rss()},
+    ]
+
+
+def bench(scores: list[Path], scales: list[int], sr: int, limit: Fraction, repeat: int, log: TextIO = sys.stderr) -> dict[str, Any]:
+    """
+    Benchmark every stage of the pipeline over `scores`.
+
+    Parsing and conversion run on every score scaled by each of `scales`.
+    Synthesis and WAV writing run on the first `limit` seconds of the original
+    scores, once per timbre and sample width, since scaling a score does not
+    change how fast its samples are computed. Every case runs in a process of
+    its own, so that its peak RSS is not that of the cases before it.
+    """
+    results: list[dict[str, Any]] = []
+    with multiprocessing.Pool(1, maxtasksperchild=1) as pool:
+        for path in scores:
+            text = path.read_text(encoding="utf-8")
+            for factor in scales:
+                log.write(f"{path.name} x{factor}: parse, flatten\n")
+                results.extend(pool.apply(run_frontend, (path.name, text, factor, repeat)))
+            for timbre in FUNCS:
+                for sw in 1, 2:
+                    log.write(f"{path.name} {timbre} sw={sw}: synth, write\n")
+                    results.extend(pool.apply(run_backend, (path.name, text, timbre, sw, sr, limit, repeat)))
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "results": results,
+        "oscillators": bench_oscillators(sr),
+        "startup": bench_startup(),
+    }
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(prog="mu bench", description="Benchmark startup, parsing, conversion, synthesis and WAV writing")
+    parser.add_argument("scores", type=Path, nargs="*", help="score files to benchmark, all those in examples/ if not specified")
+    parser.add_argument("-o", "--output", type=Path, default=None, help="output json file path, if not specified, print the results instead")
+    parser.add_argument("-s", "--scales", type=int, nargs="+", default=[1, 10, 100, 1000], help="numbers of times the passages of each score are repeated for parsing and conversion")
+    parser.add_argument("-r", "--sample-rate", type=int, default=44100, help="sample rate of the synthesized sound")
+    parser.add_argument("-l", "--limit", type=float, default=30.0, help="seconds of each score to synthesize")
+    parser.add_argument("-n", "--repeat", type=int, default=3, help="number of runs of each stage, the best of which is kept")
+    args = parser.parse_args(argv)
+    scores = args.scores or sorted(Path("examples").glob("*.μ"))
+    if not scores:
+        parser.error("no score to benchmark")
+    report = bench(scores, args.scales, args.sample_rate, Fraction(args.limit), args.repeat)
+    if args.output is None:
+        json.dump(report, sys.stdout, indent=2, ensure_ascii=False)
+        sys.stdout.write("\n")
+    else:
+        args.output.write_text(json.dumps(report, indent=2, ensure_ascii=False) + "\n", encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from fractions import Fraction
+from pathlib import Path
+from typing import Any
+
+
+# timbre, pitch, secs, frames, attack, decay, volume, sr, sw
+Key = tuple[str, int | None, Fraction, int, float, float, float, int, int]
+
+
+@dataclass
+class WaveCache:
+    """
+    Least recently used cache of note waveforms, holding at most `budget` bytes of PCM.
+
+    With a `path`, every waveform is also stored on disk in a file named after
+    the digest of its key, and read back from there when it is missing from
+    memory, so that later runs can reuse it. The cache may be shared between
+    threads, such as those rendering for `aio`; it is copied to processes
+    without its lock.
+    """
+
+    budget: int = 64 << 20
+    path: Path | None = None
+    hits: int = 0
+    misses: int = 0
+    size: int = 0
+    entries: OrderedDict[Key, bytes] = field(default_factory=lambda: OrderedDict())
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+
+    def __getstate__(self) -> dict[str, Any]:
+        return {name: value for name, value in self.__dict__.items() if name != "lock"}
+
+    def __setstate__(self, state: dict[str, Any]) -> None:
+        self.__dict__.update(state, lock=threading.Lock())
+
+    def file(self, key: Key) -> Path:
+        assert self.path is not None
+        return self.path / (hashlib.sha256(repr(key).encode()).hexdigest() + ".pcm")
+
+    def get(self, key: Key) -> bytes | None:
+        with self.lock:
+            data = self.entries.get(key)
+            if data is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return data
+        if self.path is not None and self.file(key).exists():
+            data = self.file(key).read_bytes()
+            self.keep(key, data)
+        with self.lock:
+            if data is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return data
+
+    def put(self, key: Key, data: bytes) -> None:
+        if self.path is not None:
+            self.path.mkdir(parents=True, exist_ok=True)
+            file = self.file(key)
+            temp = file.with_name(f"{file.name}.{os.getpid()}")
+            temp.write_bytes(data)
+            temp.replace(file)
+        self.keep(key, data)
+
+    def keep(self, key: Key, data: bytes) -> None:
+        """Hold `data` in memory under `key`, in place of what was held there, if anything."""
+        if len(data) > self.budget:
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self.entries[key] = data
+            self.size += len(data)
+            while self.size > self.budget:
+                _, old = self.entries.popitem(last=False)
+                self.size -= len(old)
@@ -0,0 +1,75 @@
+import argparse
+import io
+import sys
+from fractions import Fraction
+from pathlib import Path
+from typing import TextIO
+
+from . import ast
+from .parser import TextSource, TextBuffer, diagnose
+from .rhythm import timings, resolution, exact
+
+
+def check(music: ast.Music, output: TextIO = sys.stderr) -> int:
+    """
+    Write the warnings `converter.flatten_voices` would about `music`, in the same order, without converting it.
+
+    Returns the number of warnings. Nothing here imports NumPy, so that
+    checking a score costs no more than parsing it. Measures left empty by
+    `parser.diagnose` are not warned about, their errors being enough.
+    """
+    warnings = 0
+    passages = 0
+    for group in music.groups:
+        mtn = group.mtr.n
+        mtd = group.mtr.d
+        for passage in group.passages:
+            passages += 1
+            measures = [timings(measure.elements) for measure in passage.measures]
+            res, per = resolution(measures)
+            if not exact(60 * mtd, group.bmp * res, sum(n * per[d] for measure in measures for _, n, d in measure)):
+                output.write(f"Warning: Passage {passages} is timed too finely to be stored exactly, its durations being rounded by less than a picosecond where needed\n")
+                warnings += 1
+            started = False
+            for j, measure in enumerate(measures, 1):
+                ctr = 0
+                for element, n, d in measure:
+                    if isinstance(element.note, ast.Tied) and not started:
+                        output.write(f"Warning: A tied note is found at the beginning of Passage {passages}, which is considered as a rest\n")
+                        warnings += 1
+                    started = True
+                    ctr += n * per[d]
+                if ctr * mtd != mtn * res and measure:
+                    output.write(f"Warning: Passage {passages}, Measure {j} has wrong time signature, expected {Fraction(mtn, mtd)}, got {Fraction(ctr, res)}\n")
+                    warnings += 1
+    for nums in [music.final, *music.voices] if music.final is not None else []:
+        for num in nums:
+            if not 1 <= num <= passages:
+                output.write(f"Warning: Passage {num} not found, skipping\n")
+                warnings += 1
+    return warnings
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(prog="mu check", description="Check scores for all their errors and warnings in one go, without synthesizing them")
+    parser.add_argument("scores", type=Path, nargs="+", help="score files to check")
+    parser.add_argument("-s", "--strict", action="store_true", help="fail on warnings as well as on errors")
+    args = parser.parse_args(argv)
+    failed = False
+    for path in args.scores:
+        try:
+            music, errors = diagnose(TextBuffer(TextSource(name=path.name, text=path.read_text(encoding="utf-8"))), pause_gc=True)
+        except (OSError, UnicodeDecodeError) as e:
+            print(f"{path}: Error: {type(e).__name__}: {e}", file=sys.stderr)
+            failed = True
+            continue
+        for error in errors:
+            print(f"{path}: Error: {error}", file=sys.stderr)
+            failed = True
+        log = io.StringIO()
+        if check(music, log) and args.strict:
+            failed = True
+        for line in log.getvalue().splitlines():
+            print(f"{path}: {line}", file=sys.stderr)
+    if failed:
+        sys.exit(1)
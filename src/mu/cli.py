@@ -1,39 +1,188 @@
 import argparse
+import importlib
+import json
+import os
+import sys
+from contextlib import nullcontext
 from pathlib import Path
+from typing import TYPE_CHECKING, Iterable, Iterator
 
-from .parser import TextSource, TextBuffer, parse_music
-from .converter import flatten
-from .audio import AudioSettings, FUNCS
+from .parser import StreamSource, StreamBuffer, parse_music, parse_passages
+from .options import add_audio_arguments, audio_settings
+from .stats import Stats
+from . import stats
 
+# NumPy and the rest of the synthesis pipeline are only imported once a score
+# is to be played or saved, so that `--help` and `mu check` start quickly
+if TYPE_CHECKING:
+    from .audio import AudioSettings
+    from .playback import Player
+    from .tone import Tone, ToneTable
 
-def main():
-    parser = argparse.ArgumentParser(description="ProjectMu - A Numbered Musical Notation Tool")
-    parser.add_argument("filename", type=Path, help="path to the input numbered notation score file")
-    parser.add_argument("-o", "--output", type=Path, default=None, help="output wav file path, if not specified, play the sound instead")
-    parser.add_argument("-t", "--timbre", type=str, choices=FUNCS, default=next(iter(FUNCS)), help="timbre of the output sound")
-    parser.add_argument("-r", "--sample-rate", type=int, default=44100, help="sample rate of the output sound")
-    parser.add_argument("-w", "--sample-width", type=int, default=2, choices=[1, 2], help="sample width of the output sound")
-    parser.add_argument("-a", "--attack", type=float, default=0.02, help="attack time of the output sound")
-    parser.add_argument("-d", "--decay", type=float, default=0.02, help="decay time of the output sound")
-    parser.add_argument("-v", "--volume", type=float, default=0.8, help="volume of the output sound")
-    args = parser.parse_args()
-    name = args.filename.name
-    text = args.filename.read_text(encoding="utf-8")
-    source = TextSource(name=name, text=text)
-    music = parse_music(TextBuffer(source))
-    tones = flatten(music)
-    settings = AudioSettings(
-        func=FUNCS[args.timbre],
-        attack=args.attack,
-        decay=args.decay,
-        volume=args.volume,
-        sr=args.sample_rate,
-        sw=args.sample_width,
-    )
-    if args.output is None:
-        settings.play(tones)
+
+# Subcommands, each with the name of the module of this package whose `main` it runs
+COMMANDS = {"batch": "batch", "bench": "bench", "check": "check", "compile": "compiled", "serve": "server"}
+
+
+def save_streamed(settings: "AudioSettings", buff: StreamBuffer, output: Path) -> None:
+    """
+    Save the score of `buff` while it is read, parsed and converted.
+
+    Passages are synthesized in turn as they are parsed, which is right as
+    long as the score turns out to have no final order. If it does, the score
+    is saved again from its tones once it is parsed.
+    """
+    from .converter import stream_passages
+    from .tone import Tone, ToneTable
+
+    voices = list[list[ToneTable] | None]()
+
+    def tones() -> Iterator[Tone]:
+        voices.append((yield from stream_passages(parse_passages(buff))))
+
+    settings.save_stream(tones(), output)
+    if voices[0] is not None and len(voices[0]) > 1:
+        settings.save_mix(voices[0], output)
+    elif voices[0] is not None:
+        settings.save(voices[0][0], output)
+
+
+def write_out(settings: "AudioSettings", voices: "list[ToneTable] | None", tones: "Iterable[Tone] | None", output: Path, form: str) -> None:
+    """
+    Write `voices`, or the lazily converted `tones` of a single one, to `output`, or to the standard output if -.
+
+    The output is written as it is synthesized, never seeked, in the format
+    `form`, a WAV file or raw PCM. Only raw PCM can be written from `tones`,
+    there being no header to know their length for.
+    """
+    with nullcontext(sys.stdout.buffer) if output == Path("-") else output.open("wb") as file:
+        if voices is None:
+            assert tones is not None and form == "raw"
+            settings.write_pcm(tones, file)
+        elif form == "wav":
+            settings.write_wav(voices, file)
+        elif len(voices) > 1:
+            settings.write_mix_pcm(voices, file)
+        else:
+            settings.write_pcm(voices[0], file)
+
+
+def run(args: argparse.Namespace, settings: "AudioSettings") -> "Player | None":
+    """Play or save the score of `args`, returning the player if it was played."""
+    from .converter import flatten, flatten_voices, iter_tones
+    from .parallel import save_parallel, save_schedule
+    from .compiled import load_fresh
+
+    player = None
+    # written as it is synthesized, rather than to a WAV file allocated up front
+    piped = args.output is not None and (args.output == Path("-") or args.format == "raw")
+    with stats.stage("load"):
+        precompiled = load_fresh(args.filename)
+    if precompiled is not None:
+        # compiled by `mu compile` from the score as it is now, so there is nothing to parse
+        if args.output is not None and args.jobs > 1 and (precompiled.orders is None or len(precompiled.orders) == 1):
+            save_schedule(settings, *precompiled.schedule(), args.output, args.jobs)
+        else:
+            voices = precompiled.voices()
+            if piped:
+                write_out(settings, voices, None, args.output, args.format)
+            elif args.output is None:
+                player = settings.play_mix(voices, args.latency) if len(voices) > 1 else settings.play(voices[0], latency=args.latency)
+            elif len(voices) > 1:
+                settings.save_mix(voices, args.output)
+            else:
+                settings.save(voices[0], args.output)
     else:
-        settings.save(tones, args.output)
+        stdin = args.filename == Path("-")
+        with nullcontext(sys.stdin) if stdin else args.filename.open(encoding="utf-8") as file:
+            buff = StreamBuffer(StreamSource(name="<stdin>" if stdin else args.filename.name, file=file))
+            if stdin and args.output is not None and args.jobs == 1 and not piped:
+                with stats.stage("stream"):
+                    save_streamed(settings, buff, args.output)
+                return None
+            with stats.stage("parse"):
+                music = parse_music(buff, pause_gc=True)
+        if music.voices or piped and args.format == "wav":
+            # a WAV header needs the length of the score, so it is converted whole first
+            with stats.stage("flatten"):
+                voices = flatten_voices(music)
+            if piped:
+                write_out(settings, voices, None, args.output, args.format)
+            elif args.output is None:
+                player = settings.play_mix(voices, args.latency)
+            else:
+                settings.save_mix(voices, args.output)
+        elif piped:
+            write_out(settings, None, iter_tones(music), args.output, args.format)
+        elif args.output is None:
+            # convert eagerly, so that warnings are shown before the piano takes the screen
+            with stats.stage("flatten"):
+                tones = flatten(music)
+            player = settings.play(tones, latency=args.latency)
+        elif args.jobs > 1:
+            save_parallel(settings, music, args.output, args.jobs)
+        else:
+            settings.save(iter_tones(music), args.output)
+    return player
+
+
+def main(argv: list[str] | None = None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0] in COMMANDS:
+        return importlib.import_module(f"{__package__}.{COMMANDS[argv[0]]}").main(argv[1:])
+    parser = argparse.ArgumentParser(description="ProjectMu - A Numbered Musical Notation Tool")
+    parser.add_argument("filename", type=Path, help="path to the input numbered notation score file, - to read it from the standard input")
+    parser.add_argument("-o", "--output", type=Path, default=None, help="output wav file path, - for the standard output, if not specified, play the sound instead")
+    parser.add_argument("--format", type=str, choices=["wav", "raw"], default="wav", help="format of the output, raw being headerless PCM, signed 16-bit little-endian or unsigned 8-bit as the sample width")
+    add_audio_arguments(parser)
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="number of processes to render passages with when saving")
+    parser.add_argument("-l", "--latency", type=float, default=0.2, help="seconds of sound to synthesize ahead of playback")
+    parser.add_argument("--watch", action="store_true", help="render the score again into the output whenever it is modified")
+    parser.add_argument("--profile", action="store_true", help="print the time spent in every stage and counts of what went through them as json to the standard error")
+    parser.add_argument("--trace", type=Path, default=None, help="save the time spent in every stage as a chrome trace file, to view in chrome://tracing or Perfetto")
+    args = parser.parse_args(argv)
+    if args.watch and args.output is None:
+        parser.error("--watch needs an output file")
+    if args.watch and (args.profile or args.trace is not None):
+        parser.error("--watch cannot be profiled")
+    if args.watch and args.output == Path("-"):
+        parser.error("--watch needs an output file")
+    if args.format == "raw" and args.output is None:
+        parser.error("--format needs an output")
+    if args.jobs > 1 and args.output is not None and (args.output == Path("-") or args.format == "raw"):
+        parser.error("passages can only be rendered in parallel into a wav file")
+    if args.watch and args.filename == Path("-"):
+        parser.error("--watch needs a score file")
+    if args.latency <= 0:
+        parser.error("the latency must be positive")
+    if args.jobs < 1:
+        parser.error("the number of jobs must be at least 1")
+    if args.jobs > 1 and args.wavetable:
+        parser.error("wavetable oscillators cannot render passages in parallel")
+    settings = audio_settings(args)
+    if args.watch:
+        from .watch import watch
+
+        try:
+            watch(args.filename, args.output, settings)
+        except KeyboardInterrupt:
+            pass
+        return
+    profile = Stats() if args.profile or args.trace is not None else None
+    try:
+        with stats.collect(profile):
+            player = run(args, settings)
+    except BrokenPipeError:
+        # whatever reads the standard output stopped reading, so what is left of it goes nowhere
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        sys.exit(1)
+    if player is not None and player.underruns:
+        print(f"Warning: Playback ran dry {player.underruns} times, try a longer --latency", file=sys.stderr)
+    if profile is not None and args.profile:
+        json.dump(profile.report(), sys.stderr, indent=2)
+        sys.stderr.write("\n")
+    if profile is not None and args.trace is not None:
+        args.trace.write_text(json.dumps(profile.trace()), encoding="utf-8")
 
 if __name__ == "__main__":
     main()
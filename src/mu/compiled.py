@@ -0,0 +1,185 @@
+import argparse
+import hashlib
+import io
+import struct
+import sys
+from dataclasses import dataclass
+from pathlib import Path
+from typing import TextIO
+
+import numpy as np
+
+from . import ast
+from .parser import TextSource, TextBuffer, parse_music
+from .converter import Memo, index, convert, orders, arrange
+from .tone import ToneTable
+
+
+MAGIC = b"\x89MUC"
+VERSION = 1
+
+# magic, version, flags, digest of the source, then the numbers of passages,
+# orders, passages in all the orders, tones, and bytes of warnings
+HEADER = struct.Struct("<4sHH32s5Q")
+
+# set in the flags when the score has a final order, without which its
+# passages are all played in turn
+ORDERED = 1
+
+
+@dataclass
+class Compiled:
+    """
+    A score converted to tones once and for all, as stored by `dump`.
+
+    The tones of every passage are kept apart, along with the orders they are
+    played in and the warnings of their conversion, so that voices are put
+    together just as `converter.flatten_voices` would.
+    """
+
+    digest: bytes
+    passages: dict[int, ToneTable]
+    orders: list[list[int]] | None
+    warnings: str
+
+    def voices(self, output: TextIO = sys.stderr) -> list[ToneTable]:
+        """Same as `converter.flatten_voices` on the score."""
+        output.write(self.warnings)
+        return arrange(self.passages, self.orders, output)
+
+    def schedule(self, output: TextIO = sys.stderr) -> tuple[dict[int, ToneTable], list[int]]:
+        """Same as `converter.schedule` on the score, except for warnings being those of every passage."""
+        output.write(self.warnings)
+        distinct: dict[int, ToneTable] = {}
+        order: list[int] = []
+        for num in self.orders[0] if self.orders is not None else self.passages:
+            if num not in self.passages:
+                output.write(f"Warning: Passage {num} not found, skipping\n")
+            else:
+                distinct[num] = self.passages[num]
+                order.append(num)
+        return distinct, order
+
+
+def digest(text: str) -> bytes:
+    return hashlib.sha256(text.encode("utf-8")).digest()
+
+
+def artifact(path: Path) -> Path:
+    """Where the compiled form of the score at `path` is stored."""
+    return path.with_name(path.name + "c")
+
+
+def compile_music(music: ast.Music, text: str, output: TextIO = sys.stderr) -> Compiled:
+    log = io.StringIO()
+    memo: Memo = {}
+    passages = {i: ToneTable.from_tones(convert(i, group, passage, log, memo)) for i, (group, passage) in index(music).items()}
+    output.write(log.getvalue())
+    return Compiled(digest=digest(text), passages=passages, orders=orders(music), warnings=log.getvalue())
+
+
+def align(size: int) -> int:
+    return -size % 8
+
+
+def dump(compiled: Compiled, path: Path) -> None:
+    """
+    Store `compiled` at `path`, in a form that `load` maps into memory as is.
+
+    After the header come the passages, as rows of their number, first and
+    last tone, then the orders, as rows of their first and last entry, then
+    the entries themselves, then the pitches, numerators and denominators of
+    the tones of every passage, and last the warnings, in UTF-8. Sections are
+    aligned on 8 bytes and numbers are little-endian.
+    """
+    nums = list(compiled.passages)
+    sizes = [len(compiled.passages[num]) for num in nums]
+    starts = np.concatenate([[0], np.cumsum(sizes, dtype=np.int64)]).astype(np.int64)
+    table = np.stack([np.array(nums, dtype=np.int64), starts[:-1], starts[1:]], axis=1) if nums else np.empty((0, 3), dtype=np.int64)
+    orders = compiled.orders if compiled.orders is not None else []
+    entries = np.array([num for order in orders for num in order], dtype=np.int64)
+    bounds = np.concatenate([[0], np.cumsum([len(order) for order in orders], dtype=np.int64)]).astype(np.int64)
+    spans = np.stack([bounds[:-1], bounds[1:]], axis=1)
+    tones = ToneTable()
+    for num in nums:
+        tones.extend(compiled.passages[num])
+    warnings = compiled.warnings.encode("utf-8")
+    flags = ORDERED if compiled.orders is not None else 0
+    header = HEADER.pack(MAGIC, VERSION, flags, compiled.digest, len(nums), len(orders), len(entries), len(tones), len(warnings))
+    temp = path.with_name(path.name + ".tmp")
+    with temp.open("wb") as file:
+        file.write(header)
+        for section in table, spans, entries, tones.pitch, tones.num, tones.den:
+            data = section.astype(section.dtype.newbyteorder("<")).tobytes()
+            file.write(data + bytes(align(len(data))))
+        file.write(warnings)
+    temp.replace(path)
+
+
+def load(path: Path) -> Compiled | None:
+    """
+    Map the score stored at `path` by `dump`, or return None if it is not one of the current version.
+
+    Files that are truncated, or whose sections do not add up, are not
+    either, so that the score is parsed again rather than crashing on them.
+    """
+    with path.open("rb") as file:
+        head = file.read(HEADER.size)
+        size = file.seek(0, 2)
+    if len(head) < HEADER.size:
+        return None
+    magic, version, flags, source, passages, count, entries, tones, length = HEADER.unpack(head)
+    if magic != MAGIC or version != VERSION:
+        return None
+    sections = [24 * passages, 16 * count, 8 * entries, 2 * tones, 8 * tones, 8 * tones]
+    if size != HEADER.size + sum(section + align(section) for section in sections) + length:
+        return None
+    data = np.memmap(path, dtype=np.uint8, mode="r")
+    offset = HEADER.size
+
+    def take(count: int, dtype: type) -> np.ndarray:
+        nonlocal offset
+        size = count * np.dtype(dtype).itemsize
+        section = data[offset : offset + size].view(np.dtype(dtype).newbyteorder("<"))
+        offset += size + align(size)
+        return section
+
+    table = take(3 * passages, np.int64).reshape(passages, 3)
+    spans = take(2 * count, np.int64).reshape(count, 2)
+    order = take(entries, np.int64)
+    pitch, num, den = take(tones, np.int16), take(tones, np.int64), take(tones, np.int64)
+    if not all(0 <= start <= stop <= tones for _, start, stop in table.tolist()):
+        return None
+    if not all(0 <= start <= stop <= entries for start, stop in spans.tolist()):
+        return None
+    try:
+        warnings = bytes(data[offset : offset + length]).decode("utf-8")
+    except UnicodeDecodeError:
+        return None
+    return Compiled(
+        digest=source,
+        passages={int(i): ToneTable(int(stop - start), pitch[start:stop], num[start:stop], den[start:stop]) for i, start, stop in table.tolist()},
+        orders=[order[start:stop].tolist() for start, stop in spans.tolist()] if flags & ORDERED else None,
+        warnings=warnings,
+    )
+
+
+def load_fresh(path: Path) -> Compiled | None:
+    """The compiled form of the score at `path`, if there is one and it was compiled from the score as it is now."""
+    target = artifact(path)
+    if not target.exists():
+        return None
+    compiled = load(target)
+    if compiled is None or compiled.digest != digest(path.read_text(encoding="utf-8")):
+        return None
+    return compiled
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(prog="mu compile", description="Convert scores to tones ahead of time, for mu to play or save them without parsing")
+    parser.add_argument("scores", type=Path, nargs="+", help="score files to compile, each stored next to itself with a trailing c added to its name")
+    args = parser.parse_args(argv)
+    for path in args.scores:
+        text = path.read_text(encoding="utf-8")
+        music = parse_music(TextBuffer(TextSource(name=path.name, text=text)), pause_gc=True)
+        dump(compile_music(music, text), artifact(path))
@@ -1,9 +1,14 @@
+import io
+import math
 import sys
+from dataclasses import dataclass
 from fractions import Fraction
-from typing import TextIO
+from typing import Generator, Iterator, TextIO
 
 from . import ast
-from .tone import Tone
+from .tone import Tone, ToneTable
+from .rhythm import timings, resolution, exact
+from . import stats
 
 
 SOLFA: dict[ast.Solfa, int] = {
@@ -27,77 +32,243 @@ ALPHA: dict[ast.Alpha, int] = {
 }
 
 
-def flatten(music: ast.Music, output: TextIO = sys.stderr) -> list[Tone]:
-    unordered: dict[int, list[Tone]] = {}
-    i = 0
+def index(music: ast.Music) -> dict[int, tuple[ast.Group, ast.Passage]]:
+    passages: dict[int, tuple[ast.Group, ast.Passage]] = {}
     for group in music.groups:
-        sao = group.mod.sao
-        srn = SOLFA[sao.solfa] + (sao.accid if sao.accid is not None else 0) + sao.octav * 12
-        aao = group.mod.aao
-        arn = ALPHA[aao.alpha] + (aao.accid if aao.accid is not None else 0) + aao.octav * 12
-        mod = arn - srn
-        bmp = group.bmp
-        mtr = group.mtr
-        mtn = mtr.n
-        mtd = mtr.d
-        mtr = Fraction(mtn, mtd)
         for passage in group.passages:
-            i += 1
-            curr = unordered.setdefault(i, [])
-            j = 0
-            for measure in passage.measures:
-                j += 1
-                Accid: dict[ast.Solfa, int] = {"1": 0, "2": 0, "3": 0, "4": 0, "5": 0, "6": 0, "7": 0}
-                ctr = Fraction(0)
-
-                def visit(element: ast.Element, base: Fraction = Fraction(1, 4)):
-                    nonlocal ctr
-                    if isinstance(element, ast.TimedNote):
-                        note = element.note
-                        if isinstance(note, ast.SAO):
-                            if note.accid is not None:
-                                Accid[note.solfa] = note.accid
-                            rel = SOLFA[note.solfa] + Accid[note.solfa] + note.octav * 12
-                            curr.append(Tone(pitch=mod + rel))
-                        elif isinstance(note, ast.Rest):
-                            curr.append(Tone(pitch=None))
-                        elif isinstance(note, ast.Tied) and len(curr) == 0:
-                            output.write(f"Warning: A tied note is found at the beginning of Passage {i}, which is considered as a rest\n")
-                            curr.append(Tone(pitch=None))
-                        time = element.time
-                        time = Fraction(1, 2 ** time.und) * (2 - Fraction(1, 2 ** time.dot))
-                        time = time * base
-                        curr[-1].secs += time * 60 * mtd / bmp
-                        ctr += time
-                    else:
-                        if isinstance(element, ast.Rated):
-                            rat = element.ratio
-                            rtn = rat.n
-                            rtd = rat.d if rat.d is not None else 2 ** (rtn.bit_length() - 1)
-                            rat = Fraction(rtn, rtd)
-                            visit(element.inner, base / rat)
-                        elif isinstance(element, ast.Angled):
-                            for element in element.inners:
-                                visit(element, base / 2)
-                        elif isinstance(element, ast.Braced):
-                            for element in element.inners:
-                                visit(element, base)
-
-                for element in measure.elements:
-                    visit(element)
-                if ctr != mtr:
-                    output.write(f"Warning: Passage {i}, Measure {j} has wrong time signature, expected {mtr}, got {ctr}\n")
+            passages[len(passages) + 1] = group, passage
+    return passages
+
+
+@dataclass
+class Bar:
+    """
+    A measure converted on its own, in as many ticks to a whole note as it needs.
+
+    Tones start at each of `pitches`, None for rests, and last `ticks` each,
+    ties included. Ties the measure starts with last `lead` ticks, extending
+    the tone before it.
+    """
+
+    measure: ast.Measure
+    res: int
+    lead: int
+    pitches: list[int | None]
+    ticks: list[int]
+    total: int
+    ties: int
+
+
+# Measures converted so far, by key offset, then by the identity of their node,
+# which the parser shares between identical measures of a score. Each bar holds
+# on to its measure, so that no other one can take its identity while kept.
+Memo = dict[int, dict[int, Bar]]
+
+
+def convert_measure(measure: ast.Measure, mod: int) -> Bar:
+    notes = timings(measure.elements)
+    res, per = resolution([notes])
+    Accid: dict[ast.Solfa, int] = {"1": 0, "2": 0, "3": 0, "4": 0, "5": 0, "6": 0, "7": 0}
+    pitches = list[int | None]()
+    ticks = list[int]()
+    lead = total = ties = 0
+    for element, n, d in notes:
+        note = element.note
+        time = n * per[d]
+        total += time
+        if isinstance(note, ast.SAO):
+            if note.accid is not None:
+                Accid[note.solfa] = note.accid
+            pitches.append(mod + SOLFA[note.solfa] + Accid[note.solfa] + note.octav * 12)
+            ticks.append(time)
+        elif isinstance(note, ast.Rest):
+            pitches.append(None)
+            ticks.append(time)
+        else:
+            ties += 1
+            if ticks:
+                ticks[-1] += time
+            else:
+                lead += time
+    return Bar(measure, res, lead, pitches, ticks, total, ties)
+
+
+def convert(i: int, group: ast.Group, passage: ast.Passage, output: TextIO = sys.stderr, memo: Memo | None = None) -> Iterator[Tone]:
+    """
+    Convert Passage `i` of `group` into tones.
+
+    A tone is only yielded once the next note (or the end of the passage) shows
+    that no tie extends it any further. Durations are counted in whole ticks,
+    as many to a whole note as every note of the passage needs, so that a
+    tone only gets its `Fraction` of seconds once it is done. Measures are
+    converted once for all passages sharing `memo`, however many times they
+    are repeated; tempo and metre only come in here.
+    """
+    sao = group.mod.sao
+    srn = SOLFA[sao.solfa] + (sao.accid if sao.accid is not None else 0) + sao.octav * 12
+    aao = group.mod.aao
+    arn = ALPHA[aao.alpha] + (aao.accid if aao.accid is not None else 0) + aao.octav * 12
+    mod = arn - srn
+    bmp = group.bmp
+    mtn = group.mtr.n
+    mtd = group.mtr.d
+    bars = (memo if memo is not None else {}).setdefault(mod, {})
+    measures = list[Bar]()
+    for measure in passage.measures:
+        bar = bars.get(id(measure))
+        if bar is None:
+            bar = bars[id(measure)] = convert_measure(measure, mod)
+            stats.count("measures")
+        measures.append(bar)
+    res = math.lcm(*(bar.res for bar in measures))
+    # a tick lasts 60 * mtd / (bmp * res) seconds
+    num = 60 * mtd
+    den = bmp * res
+    if not exact(num, den, sum(bar.total * (res // bar.res) for bar in measures)):
+        output.write(f"Warning: Passage {i} is timed too finely to be stored exactly, its durations being rounded by less than a picosecond where needed\n")
+    # pitch and ticks of the tone being extended, if any yet
+    pitch: int | None = None
+    last = -1
+    j = 0
+    tones = ties = 0
+    for bar in measures:
+        j += 1
+        scale = res // bar.res
+        if bar.lead:
+            if last < 0:
+                output.write(f"Warning: A tied note is found at the beginning of Passage {i}, which is considered as a rest\n")
+                pitch = None
+                last = 0
+                tones += 1
+                ties -= 1
+            last += bar.lead * scale
+        for next_pitch, ticks in zip(bar.pitches, bar.ticks):
+            if last >= 0:
+                yield Tone(pitch, Fraction(last * num, den))
+            pitch = next_pitch
+            last = ticks * scale
+        tones += len(bar.pitches)
+        ties += bar.ties
+        if bar.total * mtd != mtn * bar.res:
+            output.write(f"Warning: Passage {i}, Measure {j} has wrong time signature, expected {Fraction(mtn, mtd)}, got {Fraction(bar.total, bar.res)}\n")
+    stats.count("tones", tones)
+    stats.count("ties", ties)
+    if last >= 0:
+        yield Tone(pitch, Fraction(last * num, den))
+
+
+def flatten(music: ast.Music, output: TextIO = sys.stderr) -> ToneTable:
+    return flatten_voices(music, output)[0]
+
+
+def flatten_voices(music: ast.Music, output: TextIO = sys.stderr) -> list[ToneTable]:
+    """Tones of every voice of `music`, those of the final order first, then those of `music.voices`."""
+    unordered: dict[int, ToneTable] = {}
+    memo: Memo = {}
+    for i, (group, passage) in index(music).items():
+        with stats.stage("convert", passage=i):
+            unordered[i] = ToneTable.from_tones(convert(i, group, passage, output, memo))
+    return arrange(unordered, orders(music), output)
+
+
+def orders(music: ast.Music) -> list[list[int]] | None:
+    """Orders of the passages of every voice of `music`, or None to play them all in turn."""
+    if music.final is not None:
+        return [music.final, *music.voices]
+    return None
+
+
+def arrange(passages: dict[int, ToneTable], orders: list[list[int]] | None, output: TextIO = sys.stderr) -> list[ToneTable]:
+    """Tones of every voice, each made of `passages` in its order, or of a single one made of all of them in turn."""
+    voices: list[ToneTable] = []
+    for nums in orders if orders is not None else [list(passages.keys())]:
+        tones = ToneTable()
+        for num in nums:
+            if num not in passages:
+                output.write(f"Warning: Passage {num} not found, skipping\n")
+            else:
+                tones.extend(passages[num])
+        voices.append(tones)
+
+    return voices
+
+
+def iter_tones(music: ast.Music, output: TextIO = sys.stderr) -> Iterator[Tone]:
+    """
+    Lazy counterpart of `flatten`.
+
+    Passages are converted only when the final order reaches them, and again
+    each time they are repeated, so no more than a tone is held at a time. The
+    warnings of a passage are written when it is first converted, and passages
+    left out of the final order are not checked at all.
+    """
+    passages = index(music)
 
     if music.final is not None:
         nums = music.final
     else:
-        nums = unordered.keys()
+        nums = passages.keys()
 
-    tones: list[Tone] = []
+    warned = set[int]()
+    memo: Memo = {}
     for num in nums:
-        if num not in unordered:
+        if num not in passages:
             output.write(f"Warning: Passage {num} not found, skipping\n")
         else:
-            tones.extend(unordered[num])
+            group, passage = passages[num]
+            yield from stats.timed("convert", convert(num, group, passage, output if num not in warned else io.StringIO(), memo), passage=num)
+            warned.add(num)
+
+
+def schedule(music: ast.Music, output: TextIO = sys.stderr) -> tuple[dict[int, ToneTable], list[int]]:
+    """
+    Convert every passage of the final order once, however many times it is repeated.
+
+    Returns the tones of each of those passages, and the final order itself, in
+    which passages that do not exist are skipped. Warnings are the same as those
+    of `iter_tones`, in the same order.
+    """
+    passages = index(music)
+
+    if music.final is not None:
+        nums = music.final
+    else:
+        nums = passages.keys()
+
+    distinct: dict[int, ToneTable] = {}
+    order: list[int] = []
+    memo: Memo = {}
+    for num in nums:
+        if num not in passages:
+            output.write(f"Warning: Passage {num} not found, skipping\n")
+        else:
+            if num not in distinct:
+                group, passage = passages[num]
+                with stats.stage("convert", passage=num):
+                    distinct[num] = ToneTable.from_tones(convert(num, group, passage, output, memo))
+            order.append(num)
+    return distinct, order
+
+
+def stream_passages(passages: Generator[tuple[ast.Group, ast.Passage], None, ast.Music], output: TextIO = sys.stderr) -> Generator[Tone, None, list[ToneTable] | None]:
+    """
+    Convert passages as `parser.parse_passages` parses them, yielding their tones in turn.
 
-    return tones
+    That is what is played when the score has no final order, which can only
+    be told once it is parsed completely. Returns None if so, or else the
+    tones of every voice, as `flatten_voices` would.
+    """
+    tables: dict[int, ToneTable] = {}
+    memo: Memo = {}
+    while True:
+        try:
+            group, passage = next(passages)
+        except StopIteration as stop:
+            music: ast.Music = stop.value
+            break
+        i = len(tables) + 1
+        tables[i] = table = ToneTable()
+        for tone in stats.timed("convert", convert(i, group, passage, output, memo), passage=i):
+            table.append(tone)
+            yield tone
+    return arrange(tables, orders(music), output) if music.final is not None else None
@@ -0,0 +1,40 @@
+import argparse
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .audio import AudioSettings
+
+
+# Keys of `audio.FUNCS`, named here so that parsing arguments does not import NumPy
+TIMBRES = ["sn", "pl", "sq", "tr", "st"]
+
+
+def add_audio_arguments(parser: argparse.ArgumentParser) -> None:
+    """Arguments of the sound to synthesize, shared by the commands that do."""
+    parser.add_argument("-t", "--timbre", type=str, choices=TIMBRES, default=TIMBRES[0], help="timbre of the output sound")
+    parser.add_argument("-r", "--sample-rate", type=int, default=44100, help="sample rate of the output sound")
+    parser.add_argument("-w", "--sample-width", type=int, default=2, choices=[1, 2], help="sample width of the output sound")
+    parser.add_argument("-a", "--attack", type=float, default=0.02, help="attack time of the output sound")
+    parser.add_argument("-d", "--decay", type=float, default=0.02, help="decay time of the output sound")
+    parser.add_argument("-v", "--volume", type=float, default=0.8, help="volume of the output sound")
+    parser.add_argument("-W", "--wavetable", action="store_true", help="synthesize with band-limited wavetable oscillators")
+    parser.add_argument("-c", "--cache-size", type=float, default=64, help="memory budget of the note waveform cache in MiB, 0 to disable it")
+    parser.add_argument("-C", "--cache-dir", type=Path, default=None, help="directory to persist the note waveform cache in")
+
+
+def audio_settings(args: argparse.Namespace) -> "AudioSettings":
+    from .audio import AudioSettings, FUNCS
+    from .oscillator import BANKS
+    from .cache import WaveCache
+
+    return AudioSettings(
+        func=FUNCS[args.timbre],
+        attack=args.attack,
+        decay=args.decay,
+        volume=args.volume,
+        sr=args.sample_rate,
+        sw=args.sample_width,
+        bank=BANKS[args.timbre] if args.wavetable else None,
+        cache=WaveCache(budget=int(args.cache_size * 2**20), path=args.cache_dir) if args.cache_size > 0 or args.cache_dir is not None else None,
+    )
@@ -0,0 +1,100 @@
+from dataclasses import dataclass, field
+
+import numpy as np
+
+
+# Tables hold `SIZE` points, addressed by the top `BITS` bits of 32-bit phases
+BITS = 14
+SIZE = 1 << BITS
+SHIFT = 32 - BITS
+
+
+@dataclass(frozen=True)
+class Wavetable:
+    """
+    One period of a waveform made of harmonics, sampled at `SIZE` points.
+
+    Row `k` of `levels` holds the sum of the first `k` harmonics only, so that a
+    note can be played with those of its harmonics that lie below the Nyquist
+    frequency, and never aliases. Row 0 is silent, and is the one rests read.
+    """
+
+    harmonics: np.ndarray
+    levels: np.ndarray
+
+    @classmethod
+    def build(cls, amps: dict[int, float]) -> "Wavetable":
+        harmonics = np.array(sorted(amps))
+        phase = np.arange(SIZE) / SIZE
+        levels = np.zeros((len(harmonics) + 1, SIZE))
+        for k, h in enumerate(harmonics, 1):
+            levels[k] = levels[k - 1] + np.sin(2 * np.pi * h * phase) * amps[h]
+        return cls(harmonics=harmonics, levels=levels)
+
+    def level(self, freq: np.ndarray, sr: int) -> np.ndarray:
+        with np.errstate(divide="ignore"):
+            return np.where(freq > 0, np.searchsorted(self.harmonics, sr / 2 / freq), 0)
+
+
+@dataclass(frozen=True)
+class Voice:
+    table: Wavetable
+    detune: float = 0.0
+    gain: float = 1.0
+
+
+@dataclass(frozen=True)
+class Bank:
+    voices: tuple[Voice, ...]
+
+
+@dataclass
+class Oscillator:
+    """
+    Running phase accumulators over the voices of a bank.
+
+    Phases are 32-bit fractions of a period that wrap around on their own. They
+    carry over from one call to the next, hence from one note to the next,
+    instead of restarting at zero with each of them. They start half a table
+    step in, so that truncating them to `BITS` bits rounds to the nearest point.
+    """
+
+    bank: Bank
+    phases: list[int] = field(default_factory=lambda: [])
+
+    def __post_init__(self) -> None:
+        if not self.phases:
+            self.phases = [1 << (SHIFT - 1)] * len(self.bank.voices)
+
+    def render(self, freq: np.ndarray, count: np.ndarray, sr: int) -> np.ndarray:
+        """Render `count[i]` samples at frequency `freq[i]` for each `i`, back to back."""
+        data = None
+        for v, voice in enumerate(self.bank.voices):
+            f = np.where(freq > 0, freq + voice.detune, 0.0)
+            acc = np.repeat(np.rint(f * (2**32 / sr)).astype(np.uint32), count)
+            np.cumsum(acc, dtype=np.uint32, out=acc)
+            acc += np.uint32(self.phases[v])
+            if len(acc):
+                self.phases[v] = int(acc[-1])
+            acc >>= SHIFT
+            acc += np.repeat((voice.table.level(f, sr) * SIZE).astype(np.uint32), count)
+            wave = voice.table.levels.take(acc)
+            if voice.gain != 1.0:
+                wave *= voice.gain
+            if data is None:
+                data = wave
+            else:
+                data += wave
+        return data if data is not None else np.zeros(int(count.sum()))
+
+
+SINE = Wavetable.build({1: 1.0})
+
+
+BANKS: dict[str, Bank] = {
+    "sn": Bank((Voice(SINE),)),
+    "pl": Bank((Voice(SINE, detune=-2.5, gain=1 / 3), Voice(SINE, detune=+2.5, gain=-2 / 3))),
+    "sq": Bank((Voice(Wavetable.build({2 * i + 1: 4 / np.pi / (2 * i + 1) for i in range(8)})),)),
+    "tr": Bank((Voice(Wavetable.build({2 * i + 1: 8 / np.pi**2 / (2 * i + 1) ** 2 * (-1) ** i for i in range(8)})),)),
+    "st": Bank((Voice(Wavetable.build({i + 1: 2 / np.pi / (i + 1) for i in range(8)})),)),
+}
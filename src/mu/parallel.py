@@ -0,0 +1,81 @@
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import replace
+from fractions import Fraction
+from pathlib import Path
+from typing import TextIO
+
+from . import ast
+from .audio import AudioSettings, FUNCS, timbre
+from .cache import WaveCache
+from .converter import schedule
+from .tone import ToneTable
+from . import stats, wav
+
+
+def render_into(output: Path, offset: int, size: int, key: str, settings: AudioSettings, tones: ToneTable, onset: Fraction) -> None:
+    """Render `tones`, starting at `onset` seconds, into the `size` bytes of the WAV file `output` from byte `offset` on."""
+    settings = replace(settings, func=FUNCS[key])
+    with wav.samples(output, offset, size) as data:
+        settings.render_into(tones, data, onset)
+
+
+def save_parallel(settings: AudioSettings, music: ast.Music, output: Path, jobs: int, log: TextIO = sys.stderr) -> None:
+    """Save `music` as `settings.save(iter_tones(music), output)` would, with `jobs` processes."""
+    distinct, order = schedule(music, log)
+    save_schedule(settings, distinct, order, output, jobs)
+
+
+def save_schedule(settings: AudioSettings, distinct: dict[int, ToneTable], order: list[int], output: Path, jobs: int) -> None:
+    """
+    Save the passages of `distinct` one after the other in `order`, with `jobs` processes.
+
+    The output is allocated whole up front and mapped into memory. Each
+    distinct passage of the order is synthesized once, by one of the workers,
+    straight into the place it first takes in the output, and copied from
+    there to those of its repeats. Tones are synthesized regardless of where they lie in the
+    output, except for how their onsets fall between two frames, so a repeated
+    passage is synthesized again only when its onset falls otherwise. The
+    result is byte-identical to that of serial rendering.
+    """
+    if settings.bank is not None:
+        raise ValueError("wavetable oscillators keep their phase across passages, which cannot be rendered apart")
+    key = timbre(settings.func)
+    if key is None:
+        raise ValueError("only the timbres of FUNCS can be rendered in parallel")
+    # a passage, along with the fraction of a frame its onset lies past the previous frame
+    Part = tuple[int, Fraction]
+    # every passage of the order with the byte it starts at, and the bytes each part first takes
+    places: list[tuple[Part, int]] = []
+    spans: dict[Part, tuple[int, int]] = {}
+    total = 0
+    onset = Fraction(0)
+    for num in order:
+        carry = onset * settings.sr % 1
+        part = num, carry
+        if part not in spans:
+            size = int(distinct[num].edges(settings.sr, carry / settings.sr)[-1]) * settings.sw
+            spans[part] = total, total + size
+        start, stop = spans[part]
+        places.append((part, total))
+        total += stop - start
+        onset += distinct[num].total()
+    offset = len(wav.header(settings.sr, settings.sw, total // settings.sw))
+    stats.count("frames", total // settings.sw)
+    with wav.create(output, settings.sr, settings.sw, total // settings.sw) as data:
+        # workers start with empty caches of their own, sharing the one on disk if any
+        cache = WaveCache(budget=settings.cache.budget, path=settings.cache.path) if settings.cache is not None else None
+        portable = replace(settings, func=None, cache=cache)
+        with stats.stage("synthesize", **settings.describe(), jobs=jobs), ProcessPoolExecutor(max_workers=jobs) as pool:
+            # longest passages first, so that no worker is left with a long one at the end
+            futures = [
+                pool.submit(render_into, output, offset + spans[part][0], spans[part][1] - spans[part][0], key, portable, distinct[part[0]], part[1] / settings.sr)
+                for part in sorted(spans, key=lambda part: spans[part][0] - spans[part][1])
+            ]
+            for future in futures:
+                future.result()
+        with stats.stage("copy"):
+            for part, start in places:
+                first, stop = spans[part]
+                if start != first:
+                    data[start : start + stop - first] = data[first:stop]
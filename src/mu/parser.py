@@ -1,4 +1,13 @@
+import gc
+import re
+import threading
+from bisect import bisect_right
+from contextlib import contextmanager, nullcontext
 from dataclasses import dataclass, field
+from functools import cached_property
+from itertools import accumulate
+from operator import add
+from typing import Any, Generator, Iterator, TextIO, TypeVar
 
 from . import ast
 
@@ -8,15 +17,50 @@ class TextSource:
     name: str
     text: str
 
+    @cached_property
+    def lines(self) -> list[int]:
+        """Where every line of the text starts, found once for all the errors to locate."""
+        return [0, *(match.end() for match in NEWLINES.finditer(self.text))]
+
     def get_row_col(self, idx: int) -> tuple[int, int]:
-        row = self.text.count("\n", 0, idx)
-        col = idx - (self.text.rfind("\n", 0, idx) + 1)
-        return row, col
+        row = bisect_right(self.lines, idx) - 1
+        return row, idx - self.lines[row]
+
+
+NEWLINES = re.compile("\n")
+
+
+class StreamSource:
+    """
+    Source read from a file object a line at a time, as the parser gets to it.
+
+    Only where its lines start is kept, for locating errors, so that a score
+    never has to be held in memory as a whole.
+    """
+
+    def __init__(self, name: str, file: TextIO, limit: int = 1 << 16):
+        self.name = name
+        self.file = file
+        self.limit = limit
+        self.size = 0
+        self.lines = [0]
+
+    def read(self) -> str:
+        """The next line of the source, cut after `limit` characters, or nothing at its end."""
+        line = self.file.readline(self.limit)
+        self.size += len(line)
+        if line.endswith("\n"):
+            self.lines.append(self.size)
+        return line
+
+    def get_row_col(self, idx: int) -> tuple[int, int]:
+        row = bisect_right(self.lines, idx) - 1
+        return row, idx - self.lines[row]
 
 
 @dataclass
 class ParserError(Exception):
-    _src: TextSource
+    _src: TextSource | StreamSource
     _idx: int
     _exp: dict[str, None]
 
@@ -26,198 +70,537 @@ class ParserError(Exception):
         return f"at row {row + 1}, col {col + 1}: expected one of {{{expected}}}"
 
 
+#############
+# Tokenizer #
+#############
+
+
+BLANKS = re.compile(r"\s+")
+
+
+def tokenize(text: str) -> tuple[str, list[int], list[int]]:
+    """
+    Strip all whitespace from the source text.
+
+    Every character of the grammar is a token on its own, so the token stream is
+    simply what remains. Whitespace only matters between the digits of a positive
+    integer and for locating errors, which is why the starts of the non-blank
+    runs are kept, both in the stripped text and in the source.
+    """
+    runs = text.split()
+    gaps = list(map(len, BLANKS.findall(text)))
+    if not text[:1].isspace():
+        gaps.insert(0, 0)
+    starts = list(accumulate(map(len, runs), initial=0))
+    offsets = list(map(add, starts, accumulate(gaps)))[: len(runs)]
+    return "".join(runs), starts[: len(runs)], offsets
+
+
+T = TypeVar("T")
+
+
+@dataclass
+class Nodes:
+    """Nodes of the syntax tree parsed so far, for identical ones to be shared."""
+
+    nodes: dict[Any, Any] = field(default_factory=lambda: {})
+    # timed notes by their tokens, and measures by their text, as matched by the fast paths
+    notes: dict[tuple[str, ...], ast.TimedNote] = field(default_factory=lambda: {})
+    measures: dict[str, ast.Measure] = field(default_factory=lambda: {})
+
+    def intern(self, node: T, *children: object) -> T:
+        """
+        The node equal to `node` met before, if any, or else `node` itself, from now on.
+
+        A node with `children`, interned already, is told by their identities
+        rather than by its whole subtree, which would be hashed all over again
+        at every level.
+        """
+        key = (type(node), *map(id, children)) if children else node
+        return self.nodes.setdefault(key, node)
+
+
 @dataclass
 class TextBuffer:
     _src: TextSource
     _idx: int = 0
 
     _farthest_idx: int = 0
-    _farthest_exp: dict[str, None] = field(default_factory=lambda: {})
+    _farthest_exp: list[tuple[str, ...]] = field(default_factory=lambda: [])
+    # errors recovered from so far, when they are collected rather than raised
+    _errors: list[ParserError] | None = field(default=None, init=False)
+    _nodes: Nodes = field(default_factory=lambda: Nodes(), init=False)
+
+    _text: str = field(init=False)
+    _starts: list[int] = field(init=False)
+    _offsets: list[int] = field(init=False)
+
+    def __post_init__(self) -> None:
+        self._text, self._starts, self._offsets = tokenize(self._src.text)
 
     def tell(self) -> int:
         return self._idx
 
-    def seek(self, idx: int) -> None:
-        self._idx = idx
-
-    def peek(self, length: int | None = None) -> str:
-        if length is None:
-            return self._src.text[self._idx :]
-        return self._src.text[self._idx : self._idx + length]
+    def peek(self) -> str:
+        return self._text[self._idx : self._idx + 1]
 
-    def move(self, length: int) -> None:
+    def move(self, length: int = 1) -> None:
         self._idx += length
 
-    def set_expected(self, exp: str) -> None:
+    def match(self, pattern: re.Pattern[str]) -> re.Match[str] | None:
+        match = pattern.match(self._text, self._idx)
+        if match is not None:
+            self._idx = match.end()
+        return match
+
+    def glued(self) -> bool:
+        """Whether the next token directly follows the previous one in the source."""
+        run = bisect_right(self._starts, self._idx) - 1
+        return self._starts[run] != self._idx
+
+    def offset(self, idx: int) -> int:
+        if idx >= len(self._text):
+            return len(self._src.text)
+        run = bisect_right(self._starts, idx) - 1
+        return self._offsets[run] + idx - self._starts[run]
+
+    def set_expected(self, *exps: str) -> None:
         if self._idx > self._farthest_idx:
             self._farthest_idx = self._idx
-            self._farthest_exp = {}
-        if self._idx == self._farthest_idx:
-            self._farthest_exp.setdefault(exp, None)
+            self._farthest_exp = [exps]
+        elif self._idx == self._farthest_idx:
+            self._farthest_exp.append(exps)
 
     def create_error(self) -> ParserError:
         return ParserError(
             _src=self._src,
-            _idx=self._farthest_idx,
-            _exp=self._farthest_exp,
+            _idx=self.offset(self._farthest_idx),
+            _exp=dict.fromkeys(exp for exps in self._farthest_exp for exp in exps),
         )
 
+    def recover(self, error: ParserError, pattern: re.Pattern[str], skipped: list[str] | None = None) -> bool:
+        """
+        Record `error` and skip the tokens of `pattern`, if errors are collected, or else return False for it to be raised.
+
+        Skipping stops past a bar line or before a semicolon, whichever comes
+        first, or at the end of the source, a group only being skipped past
+        the bar line before the end of the score. The tokens skipped are
+        added to `skipped`, if given. An error where the previous one was is
+        the same one, run into again on the way out.
+        """
+        if self._errors is None:
+            return False
+        if not self._errors or self._errors[-1]._idx != error._idx:
+            self._errors.append(error)
+        while True:
+            match = self.match(pattern)
+            assert match is not None
+            if skipped is not None:
+                skipped.append(match.group())
+            if self.peek() in (";", ""):
+                break
+            if match.group().endswith("|") and (pattern is not PAST_GROUP or self.peek() in ("|", ":")):
+                break
+        self._farthest_idx = self._idx
+        self._farthest_exp = []
+        return True
+
+
+# Characters read at least each time the window of a `StreamBuffer` is extended
+FILL = 1 << 12
+
+
+@dataclass
+class StreamBuffer(TextBuffer):
+    """
+    `TextBuffer` over a `StreamSource`, holding only a window of its tokens.
+
+    Positions are counted from the start of the source all the same. Whenever
+    the parser reaches the end of the window, lines are read until there are
+    `FILL` characters or so, and the window is extended with their tokens up
+    to the last bar line among them, or to the end of the source, so that the
+    fast paths never match a run of measures cut short within a measure. The
+    tokens the parser is done with, and has no error to report in, are
+    dropped along the way.
+    """
+
+    _src: StreamSource
+    # tokens dropped from the window, text read past its last bar line, and where that text starts
+    _base: int = 0
+    _raw: str = ""
+    _read: int = 0
+
+    def __post_init__(self) -> None:
+        self._text, self._starts, self._offsets = "", [], []
+
+    def fill(self) -> bool:
+        """Extend the window, and return whether there were any tokens left."""
+        keep = min(self._idx, self._farthest_idx) - self._base
+        if keep > len(self._text) // 2:
+            self._text = self._text[keep:]
+            self._base += keep
+            run = bisect_right(self._starts, self._base) - 1
+            del self._starts[:run], self._offsets[:run]
+        while True:
+            line = self._src.read()
+            self._raw += line
+            if line and len(self._raw) < FILL:
+                continue
+            bar = self._raw.rfind("|") if line else len(self._raw) - 1
+            if line and bar < 0:
+                continue
+            segment, self._raw = self._raw[: bar + 1], self._raw[bar + 1 :]
+            text, starts, offsets = tokenize(segment)
+            end = self._base + len(self._text)
+            self._starts.extend(end + start for start in starts)
+            self._offsets.extend(self._read + offset for offset in offsets)
+            self._text += text
+            self._read += len(segment)
+            if text or not line:
+                return bool(text)
+
+    def peek(self) -> str:
+        i = self._idx - self._base
+        if i >= len(self._text) and self.fill():
+            i = self._idx - self._base
+        return self._text[i : i + 1]
+
+    def match(self, pattern: re.Pattern[str]) -> re.Match[str] | None:
+        if self._idx - self._base >= len(self._text):
+            self.fill()
+        match = pattern.match(self._text, self._idx - self._base)
+        if match is not None:
+            self._idx = self._base + match.end()
+        return match
+
+    def offset(self, idx: int) -> int:
+        if idx >= self._base + len(self._text):
+            return self._src.size
+        run = bisect_right(self._starts, idx) - 1
+        return self._offsets[run] + idx - self._starts[run]
+
 
 ###################
 # Grammar parsers #
 ###################
 
+# The grammar is LL(1): every choice is decided by the next token alone, so the
+# parsers below never backtrack. Whenever an optional or repeated item is absent,
+# the tokens that were looked for are still recorded with `set_expected`, which
+# keeps the reported expectations identical to those of a backtracking parser.
+
+
+NONZERO = frozenset("123456789")
+DIGITS = frozenset("0123456789")
+SOLFAS = frozenset("1234567")
+ALPHAS = frozenset("CDEFGAB")
+NOTE_FIRST = frozenset("@#b12345670-")
+ELEMENT_FIRST = frozenset("@#b12345670-{<[")
+
+ACCID_EXP = ("'@'", "'#'", "'b'")
+OCTAV_EXP = ('"\'"', "','")
+NOTE_EXP = (*ACCID_EXP, "<1-7>", "'0'", "'-'")
+ELEMENT_EXP = (*NOTE_EXP, "'{'", "'<'", "'['")
+
+# Runs of measures or elements holding nothing but timed notes and unnested
+# groups of them are read with a single match, then split into tokens by another.
+# Anything else goes through the token-by-token parsers, which report where it
+# went wrong. The last token of a run tells what they would have looked for next.
+NOTE = r"(?:(?:@|#+|b+)?[1-7](?:'+|,+)?|[0-])/*\.*"
+FLAT = rf"(?:{NOTE}|<(?:{NOTE})*>|\{{(?:{NOTE})*\}})+"
+FLAT_ELEMENTS = re.compile(FLAT)
+FLAT_MEASURES = re.compile(rf"(?:{FLAT}\|)+")
+FLAT_TOKEN = re.compile(r"(?:(@|#+|b+)?([1-7])('+|,+)?|([0-]))(/*)(\.*)|([<>{}|])")
+
+SIGNS = {"@": 0, "#": +1, "b": -1, "'": +1, ",": -1}
+
+TIME_EXP = ("'/'", "'.'")
+TAIL_EXP = {
+    **{solfa: (*OCTAV_EXP, *TIME_EXP) for solfa in SOLFAS},
+    "'": (OCTAV_EXP[0], *TIME_EXP),
+    ",": (OCTAV_EXP[1], *TIME_EXP),
+    "0": TIME_EXP,
+    "-": TIME_EXP,
+    "/": TIME_EXP,
+    ".": ("'.'",),
+    ">": (),
+    "}": (),
+}
+
+
+# Number of parses pausing the collector, and whether it was enabled before the first of them
+paused = 0
+resume = False
+pausing = threading.Lock()
+
+
+@contextmanager
+def collector_paused() -> Iterator[None]:
+    """
+    Pause the cyclic garbage collector.
+
+    The syntax tree has no cycles, yet every node of it is tracked by the
+    collector, whose passes over the growing tree would take a good share of the
+    parsing time. Parses on several threads share one pause, the collector
+    being enabled again once the last of them is done, and only if it was
+    enabled before the first, so that a caller can keep it disabled.
+    """
+    global paused, resume
+    with pausing:
+        if not paused:
+            resume = gc.isenabled()
+            gc.disable()
+        paused += 1
+    try:
+        yield
+    finally:
+        with pausing:
+            paused -= 1
+            if not paused and resume:
+                gc.enable()
+
+
+def diagnose(buff: TextBuffer, pause_gc: bool = False) -> tuple[ast.Music, list[ParserError]]:
+    """
+    Parse a score like `parse_music`, carrying on past syntax errors to find them all.
+
+    A measure that cannot be parsed is left empty, and so are the passages of
+    a group whose header cannot be parsed, under `SKIPPED` in place of its
+    header, so that the passages after them keep their numbers. The tokens
+    after the error are skipped up to the next bar line, or the next group
+    if the header was at fault. Returns what could be parsed along with the
+    errors.
+    """
+    buff._errors = []
+    try:
+        return parse_music(buff, pause_gc), buff._errors
+    finally:
+        buff._errors = None
+
+
+def parse_music(buff: TextBuffer, pause_gc: bool = False) -> ast.Music:
+    """
+    Parse the score of `buff`.
+
+    With `pause_gc`, the garbage collector of the whole process is paused
+    meanwhile, see `collector_paused`, which only suits programs doing
+    nothing else in the meantime, such as the command line tools.
+    """
+    with collector_paused() if pause_gc else nullcontext():
+        passages = parse_passages(buff)
+        while True:
+            try:
+                next(passages)
+            except StopIteration as stop:
+                return stop.value
+
 
-def parse_music(buff: TextBuffer) -> ast.Music:
-    groups = [parse_group(buff)]
+def parse_passages(buff: TextBuffer) -> Generator[tuple[ast.Group, ast.Passage], None, ast.Music]:
+    """
+    Parse a score like `parse_music`, yielding every passage as soon as it is parsed.
+
+    Passages come with their group, which only holds those parsed so far.
+    """
+    groups = list[ast.Group]()
     while True:
-        told = buff.tell()
-        try:
-            parse_ch(buff, ";")
-            groups.append(parse_group(buff))
-        except ParserError:
-            buff.seek(told)
+        groups.append((yield from parse_group(buff)))
+        if not parse_opt_ch(buff, ";"):
             break
-    final = parse_final(buff)
-    parse_eof(buff)
-    return ast.Music(groups=groups, final=final)
+    try:
+        final, voices = parse_final(buff)
+        parse_eof(buff)
+    except ParserError as e:
+        if not buff.recover(e, PAST_FINAL):
+            raise
+        final, voices = None, []
+    return ast.Music(groups=groups, final=final, voices=voices)
+
 
+# Tokens skipped past a measure, the header of a group, or the final order,
+# that cannot be parsed. A group is only skipped up to the bar line closing
+# its last measure, the || or |: after it ending the score.
+PAST_MEASURE = re.compile(r"[^|;]*\|?")
+PAST_GROUP = re.compile(r"(?:[^|;]|\|(?![|:]))*\|?")
+PAST_FINAL = re.compile(r".*", re.DOTALL)
 
-def parse_group(buff: TextBuffer) -> ast.Group:
-    mod = parse_mod(buff)
-    mtr = parse_mtr(buff)
-    bmp = parse_bmp(buff)
-    passages = [parse_passage(buff)]
+# Header of a group whose own cannot be parsed
+SKIPPED = ast.Mode(ast.SAO("1", None, 0), ast.AAO("C", None, 0)), ast.Metre(4, 4), 120
+
+
+def parse_group(buff: TextBuffer) -> Generator[tuple[ast.Group, ast.Passage], None, ast.Group]:
+    try:
+        mod = parse_mod(buff)
+        mtr = parse_mtr(buff)
+        bmp = parse_bmp(buff)
+    except ParserError as e:
+        skipped = list[str]()
+        if not buff.recover(e, PAST_GROUP, skipped):
+            raise
+        mod, mtr, bmp = SKIPPED
+        group = ast.Group(mod=mod, mtr=mtr, bmp=bmp, passages=[])
+        # a comma right after a bar line can only part passages, those of notes following them
+        for _ in range("".join(skipped).count("|,") + 1):
+            passage = buff._nodes.intern(ast.Passage(measures=()))
+            group.passages.append(passage)
+            yield group, passage
+        return group
+    group = ast.Group(mod=mod, mtr=mtr, bmp=bmp, passages=[])
     while True:
-        told = buff.tell()
-        try:
-            parse_ch(buff, ",")
-            passages.append(parse_passage(buff))
-        except ParserError:
-            buff.seek(told)
-            break
-    return ast.Group(mod=mod, mtr=mtr, bmp=bmp, passages=passages)
+        passage = parse_passage(buff)
+        group.passages.append(passage)
+        yield group, passage
+        if not parse_opt_ch(buff, ","):
+            return group
 
 
 def parse_passage(buff: TextBuffer) -> ast.Passage:
-    measures = [parse_measure(buff)]
+    measures = list[ast.Measure]()
     while True:
-        told = buff.tell()
+        match = buff.match(FLAT_MEASURES)
+        if match is not None:
+            measures.extend(build_measures(buff._nodes, match.group()))
+        if measures and buff.peek() not in ELEMENT_FIRST:
+            buff.set_expected(*ELEMENT_EXP)
+            return buff._nodes.intern(ast.Passage(measures=tuple(measures)), *measures)
         try:
             measures.append(parse_measure(buff))
-        except ParserError:
-            buff.seek(told)
-            break
-    return ast.Passage(measures=measures)
+        except ParserError as e:
+            if not buff.recover(e, PAST_MEASURE):
+                raise
+            measures.append(buff._nodes.intern(ast.Measure(elements=())))
 
 
 def parse_measure(buff: TextBuffer) -> ast.Measure:
-    elements = [parse_element(buff)]
-    while True:
-        told = buff.tell()
-        try:
-            elements.append(parse_element(buff))
-        except ParserError:
-            buff.seek(told)
-            break
+    elements = parse_elements(buff)
+    if not elements:
+        raise buff.create_error()
     parse_ch(buff, "|")
-    return ast.Measure(elements=elements)
+    return buff._nodes.intern(ast.Measure(elements=tuple(elements)), *elements)
 
 
 def parse_element(buff: TextBuffer) -> ast.Element:
-    told = buff.tell()
-    try:
+    char = buff.peek()
+    if char in NOTE_FIRST:
         return parse_timed_note(buff)
-    except ParserError:
-        buff.seek(told)
-    told = buff.tell()
-    try:
+    if char == "{":
         return parse_braced(buff)
-    except ParserError:
-        buff.seek(told)
-    told = buff.tell()
-    try:
+    if char == "<":
         return parse_angled(buff)
-    except ParserError:
-        buff.seek(told)
-    told = buff.tell()
-    try:
+    if char == "[":
         return parse_rated(buff)
-    except ParserError:
-        buff.seek(told)
+    buff.set_expected(*ELEMENT_EXP)
     raise buff.create_error()
 
 
+def parse_elements(buff: TextBuffer) -> list[ast.Element]:
+    elements = list[ast.Element]()
+    while True:
+        match = buff.match(FLAT_ELEMENTS)
+        if match is not None:
+            text = match.group()
+            buff.set_expected(*TAIL_EXP[text[-1]])
+            elements.extend(build_elements(buff._nodes, text))
+        if buff.peek() not in ELEMENT_FIRST:
+            buff.set_expected(*ELEMENT_EXP)
+            return elements
+        elements.append(parse_element(buff))
+
+
+def build_measures(nodes: Nodes, text: str) -> list[ast.Measure]:
+    """Measures of a match of `FLAT_MEASURES`, each built only the first time its text is met."""
+    measures = list[ast.Measure]()
+    for bar in text.split("|")[:-1]:
+        measure = nodes.measures.get(bar)
+        if measure is None:
+            elements = build_elements(nodes, bar)
+            measure = nodes.measures[bar] = nodes.intern(ast.Measure(tuple(elements)), *elements)
+        measures.append(measure)
+    return measures
+
+
+def build_elements(nodes: Nodes, text: str) -> list[ast.Element]:
+    """Elements of a match of `FLAT_ELEMENTS`, or of a measure of one of `FLAT_MEASURES`."""
+    outer: list[ast.Element] = []
+    elements = outer
+    for token in FLAT_TOKEN.findall(text):
+        mark = token[6]
+        if mark == "":
+            note = nodes.notes.get(token)
+            if note is None:
+                note = nodes.notes[token] = build_timed_note(nodes, *token[:6])
+            elements.append(note)
+        elif mark == "<" or mark == "{":
+            elements = []
+        else:
+            outer.append(nodes.intern(ast.Angled(tuple(elements)) if mark == ">" else ast.Braced(tuple(elements)), *elements))
+            elements = outer
+    return outer
+
+
+def build_timed_note(nodes: Nodes, accid: str, solfa: str, octav: str, other: str, und: str, dot: str) -> ast.TimedNote:
+    # Called once per distinct note, hence the positional arguments, which are
+    # noticeably cheaper than keywords for the generated dataclass constructors.
+    if solfa:
+        note = ast.SAO(
+            solfa,  # type: ignore
+            SIGNS[accid[0]] * len(accid) if accid else None,
+            SIGNS[octav[0]] * len(octav) if octav else 0,
+        )
+    else:
+        note = ast.Rest() if other == "0" else ast.Tied()
+    note = nodes.intern(note)
+    time = nodes.intern(ast.Time(len(und), len(dot)))
+    return nodes.intern(ast.TimedNote(note, time), note, time)
+
+
 def parse_timed_note(buff: TextBuffer) -> ast.TimedNote:
     note = parse_note(buff)
     time = parse_time(buff)
-    return ast.TimedNote(note=note, time=time)
+    note = buff._nodes.intern(note)
+    time = buff._nodes.intern(time)
+    return buff._nodes.intern(ast.TimedNote(note=note, time=time), note, time)
 
 
 def parse_braced(buff: TextBuffer) -> ast.Braced:
     parse_ch(buff, "{")
-    elements = list[ast.Element]()
-    while True:
-        told = buff.tell()
-        try:
-            elements.append(parse_element(buff))
-        except ParserError:
-            buff.seek(told)
-            break
+    elements = parse_elements(buff)
     parse_ch(buff, "}")
-    return ast.Braced(inners=elements)
+    return buff._nodes.intern(ast.Braced(inners=tuple(elements)), *elements)
 
 
 def parse_angled(buff: TextBuffer) -> ast.Angled:
     parse_ch(buff, "<")
-    elements = list[ast.Element]()
-    while True:
-        told = buff.tell()
-        try:
-            elements.append(parse_element(buff))
-        except ParserError:
-            buff.seek(told)
-            break
+    elements = parse_elements(buff)
     parse_ch(buff, ">")
-    return ast.Angled(inners=elements)
+    return buff._nodes.intern(ast.Angled(inners=tuple(elements)), *elements)
 
 
 def parse_rated(buff: TextBuffer) -> ast.Rated:
     rat = parse_rat(buff)
     inner = parse_element(buff)
-    return ast.Rated(ratio=rat, inner=inner)
+    rat = buff._nodes.intern(rat)
+    return buff._nodes.intern(ast.Rated(ratio=rat, inner=inner), rat, inner)
 
 
 def parse_rat(buff: TextBuffer) -> ast.Ratio:
     parse_ch(buff, "[")
     n = parse_positive(buff)
-    told = buff.tell()
-    try:
-        parse_ch(buff, ":")
-        d = parse_positive(buff)
-    except ParserError:
-        buff.seek(told)
-        d = None
+    d = parse_positive(buff) if parse_opt_ch(buff, ":") else None
     parse_ch(buff, "]")
     return ast.Ratio(n=n, d=d)
 
 
 def parse_note(buff: TextBuffer) -> ast.Note:
-    told = buff.tell()
-    try:
+    char = buff.peek()
+    if char == "0":
+        buff.move()
+        return ast.Rest()
+    if char == "-":
+        buff.move()
+        return ast.Tied()
+    if char in NOTE_FIRST:
         return parse_sao(buff)
-    except ParserError:
-        buff.seek(told)
-    told = buff.tell()
-    try:
-        return parse_rest(buff)
-    except ParserError:
-        buff.seek(told)
-    told = buff.tell()
-    try:
-        return parse_tied(buff)
-    except ParserError:
-        buff.seek(told)
+    buff.set_expected(*NOTE_EXP)
     raise buff.create_error()
 
 
@@ -228,16 +611,6 @@ def parse_sao(buff: TextBuffer) -> ast.SAO:
     return ast.SAO(solfa=solfa, accid=accid, octav=octav)
 
 
-def parse_rest(buff: TextBuffer) -> ast.Rest:
-    parse_ch(buff, "0")
-    return ast.Rest()
-
-
-def parse_tied(buff: TextBuffer) -> ast.Tied:
-    parse_ch(buff, "-")
-    return ast.Tied()
-
-
 def parse_aao(buff: TextBuffer) -> ast.AAO:
     alpha = parse_alpha(buff)
     accid = parse_accid(buff)
@@ -264,125 +637,54 @@ def parse_bmp(buff: TextBuffer) -> int:
 
 
 def parse_accid(buff: TextBuffer) -> int | None:
-    told = buff.tell()
-    try:
-        parse_ch(buff, "@")
+    char = buff.peek()
+    if char == "@":
+        buff.move()
         return 0
-    except ParserError:
-        buff.seek(told)
-    told = buff.tell()
-    try:
-        parse_ch(buff, "#")
-        i = +1
-        while True:
-            told = buff.tell()
-            try:
-                parse_ch(buff, "#")
-                i += 1
-            except ParserError:
-                buff.seek(told)
-                break
-        return i
-    except ParserError:
-        buff.seek(told)
-    told = buff.tell()
-    try:
-        parse_ch(buff, "b")
-        i = -1
-        while True:
-            told = buff.tell()
-            try:
-                parse_ch(buff, "b")
-                i -= 1
-            except ParserError:
-                buff.seek(told)
-                break
-        return i
-    except ParserError:
-        buff.seek(told)
+    if char == "#":
+        return +parse_repeat(buff, "#")
+    if char == "b":
+        return -parse_repeat(buff, "b")
+    buff.set_expected(*ACCID_EXP)
     return None
 
 
 def parse_octav(buff: TextBuffer) -> int:
-    told = buff.tell()
-    try:
-        parse_ch(buff, "'")
-        i = +1
-        while True:
-            told = buff.tell()
-            try:
-                parse_ch(buff, "'")
-                i += 1
-            except ParserError:
-                buff.seek(told)
-                break
-        return i
-    except ParserError:
-        buff.seek(told)
-    told = buff.tell()
-    try:
-        parse_ch(buff, ",")
-        i = -1
-        while True:
-            told = buff.tell()
-            try:
-                parse_ch(buff, ",")
-                i -= 1
-            except ParserError:
-                buff.seek(told)
-                break
-        return i
-    except ParserError:
-        buff.seek(told)
+    char = buff.peek()
+    if char == "'":
+        return +parse_repeat(buff, "'")
+    if char == ",":
+        return -parse_repeat(buff, ",")
+    buff.set_expected(*OCTAV_EXP)
     return 0
 
 
 def parse_time(buff: TextBuffer) -> ast.Time:
-    und = 0
-    while True:
-        told = buff.tell()
-        try:
-            parse_ch(buff, "/")
-            und += 1
-        except ParserError:
-            buff.seek(told)
-            break
-    dot = 0
-    while True:
-        told = buff.tell()
-        try:
-            parse_ch(buff, ".")
-            dot += 1
-        except ParserError:
-            buff.seek(told)
-            break
+    und = parse_repeat(buff, "/")
+    dot = parse_repeat(buff, ".")
     return ast.Time(und=und, dot=dot)
 
 
-def parse_final(buff: TextBuffer) -> list[int] | None:
-    told = buff.tell()
-    try:
-        return parse_ch(buff, "|")
-    except ParserError:
-        buff.seek(told)
-    told = buff.tell()
-    try:
-        return parse_order(buff)
-    except ParserError:
-        buff.seek(told)
+def parse_final(buff: TextBuffer) -> tuple[list[int] | None, list[list[int]]]:
+    if parse_opt_ch(buff, "|"):
+        return None, []
+    if buff.peek() == ":":
+        final = parse_order(buff)
+        voices = list[list[int]]()
+        while buff.peek() == ":":
+            voices.append(parse_order(buff))
+        buff.set_expected("':'")
+        return final, voices
+    buff.set_expected("':'")
     raise buff.create_error()
 
 
 def parse_order(buff: TextBuffer) -> list[int]:
     parse_ch(buff, ":")
     nums = list[int]()
-    while True:
-        told = buff.tell()
-        try:
-            nums.append(parse_positive(buff))
-        except ParserError:
-            buff.seek(told)
-            break
+    while buff.peek() in NONZERO:
+        nums.append(parse_positive(buff))
+    buff.set_expected("<positive integer>")
     return nums
 
 
@@ -392,59 +694,60 @@ def parse_order(buff: TextBuffer) -> list[int]:
 
 
 def parse_positive(buff: TextBuffer) -> int:
-    parse_ws(buff)
-    buff.set_expected("<positive integer>")
-    char = buff.peek(1)
-    if char not in ("1", "2", "3", "4", "5", "6", "7", "8", "9"):
+    num = buff.peek()
+    if num not in NONZERO:
+        buff.set_expected("<positive integer>")
         raise buff.create_error()
-    buff.move(1)
-    num = char
-    while True:
-        char = buff.peek(1)
-        if char not in ("0", "1", "2", "3", "4", "5", "6", "7", "8", "9"):
-            break
-        buff.move(1)
-        num += char
+    buff.move()
+    while buff.peek() in DIGITS and buff.glued():
+        num += buff.peek()
+        buff.move()
     return int(num)
 
 
 def parse_alpha(buff: TextBuffer) -> ast.Alpha:
-    parse_ws(buff)
-    buff.set_expected("<A-G>")
-    read = buff.peek(1)
-    if read not in ("C", "D", "E", "F", "G", "A", "B"):
+    read = buff.peek()
+    if read not in ALPHAS:
+        buff.set_expected("<A-G>")
         raise buff.create_error()
-    buff.move(1)
+    buff.move()
     return read
 
 
 def parse_solfa(buff: TextBuffer) -> ast.Solfa:
-    parse_ws(buff)
-    buff.set_expected("<1-7>")
-    read = buff.peek(1)
-    if read not in ("1", "2", "3", "4", "5", "6", "7"):
+    read = buff.peek()
+    if read not in SOLFAS:
+        buff.set_expected("<1-7>")
         raise buff.create_error()
-    buff.move(1)
+    buff.move()
     return read
 
 
-def parse_ch(buff: TextBuffer, char: str) -> None:
-    parse_ws(buff)
+def parse_repeat(buff: TextBuffer, char: str) -> int:
+    i = 0
+    while buff.peek() == char:
+        buff.move()
+        i += 1
     buff.set_expected(repr(char))
-    read = buff.peek(1)
-    if read != char:
-        raise buff.create_error()
-    buff.move(1)
+    return i
 
 
-def parse_eof(buff: TextBuffer) -> None:
-    parse_ws(buff)
-    buff.set_expected("<EOF>")
-    read = buff.peek()
-    if read:
+def parse_opt_ch(buff: TextBuffer, char: str) -> bool:
+    if buff.peek() != char:
+        buff.set_expected(repr(char))
+        return False
+    buff.move()
+    return True
+
+
+def parse_ch(buff: TextBuffer, char: str) -> None:
+    if buff.peek() != char:
+        buff.set_expected(repr(char))
         raise buff.create_error()
+    buff.move()
 
 
-def parse_ws(buff: TextBuffer) -> None:
-    while buff.peek(1).isspace():
-        buff.move(1)
+def parse_eof(buff: TextBuffer) -> None:
+    if buff.peek():
+        buff.set_expected("<EOF>")
+        raise buff.create_error()
@@ -1,3 +1,4 @@
+import threading
 from typing import TextIO
 
 
@@ -6,24 +7,64 @@ bdct = {0: 1, 1: 3, 3: 6, 4: 8, 5: 10}
 wlst = [None if i % 7 not in wdct else wdct[i % 7] + i // 7 * 12 for i in range(-23, 29)]
 blst = [None if i % 7 not in bdct else bdct[i % 7] + i // 7 * 12 for i in range(-23, 28)]
 
+# Cells of a keyboard, as (foreground, background, character) by row then column
+Cells = list[list[tuple[int, int, str]]]
+
 
 class Piano:
-    def __init__(self, output: TextIO, W: int = 2, B: int = 1, U: int = 2, D: int = 3, T: int = 0, L: int = 0):
+    """
+    Keyboard drawn in the terminal, with the key being played highlighted.
+
+    The cells of the keyboard are computed once per highlighted pitch, and
+    only those that differ between the frame on screen and the next one are
+    written, in a single write per frame. `show` only sets the pitch to draw,
+    and frames are drawn `fps` times per second by a thread of their own, so
+    that the caller is never held up by the terminal.
+    """
+
+    def __init__(self, output: TextIO, W: int = 2, B: int = 1, U: int = 2, D: int = 3, T: int = 0, L: int = 0, fps: float = 60.0):
         self.args = W, B, U, D, T, L
         self.output = output
+        self.fps = fps
+        self.frames: dict[int | None, Cells] = {}
+        self.diffs: dict[tuple[int | None, int | None], str] = {}
+        self.pitch: int | None = None
+        self.shown: int | None = None
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
 
     def __enter__(self):
         self.output.write("\033[?1049h")
         self.output.write("\033[?25l")
+        self.output.write(self.full(None))
         self.output.flush()
+        self.thread.start()
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop.set()
+        self.thread.join()
         self.output.write("\033[?1049l")
         self.output.write("\033[?25h")
         self.output.flush()
 
     def show(self, h: int | None):
+        self.pitch = h
+
+    def run(self):
+        while not self.stop.wait(1 / self.fps):
+            self.draw(self.pitch)
+
+    def draw(self, h: int | None):
+        if h == self.shown:
+            return
+        self.output.write(self.diff(self.shown, h))
+        self.output.flush()
+        self.shown = h
+
+    def cells(self, h: int | None) -> Cells:
+        if h in self.frames:
+            return self.frames[h]
         W, B, U, D, T, L = self.args
         grid = [[[9, 9] for _ in range(W * 52 * 2)] for _ in range(max(U, D))]
         for i, v in enumerate(wlst):
@@ -42,15 +83,46 @@ class Piano:
                 for j in range(2 * W - B, 2 * W + B - 1):
                     grid[k][i * 2 * W + j][0] = grid[k][i * 2 * W + j][1] = x
                 grid[k][i * 2 * W + 2 * W + B - 1][0] = x
-        self.output.write("\033[2J")
-        for i in range(0, max(U, D)):
-            self.output.write("\033[{};{}H".format(T + i + 1, L + 1))
-            for (a, b), (c, d) in zip(grid[i][0::2], grid[i][1::2]):
+        cells: Cells = []
+        for row in grid:
+            line = list[tuple[int, int, str]]()
+            for (a, b), (c, d) in zip(row[0::2], row[1::2]):
                 if a == 9:
-                    self.output.write("\033[{};{}m".format(30 + d, 40 + a))
-                    self.output.write(" " if a == b == c == d else "▕" if a == b == c else "▐" if a == b and c == d else "?")
+                    line.append((30 + d, 40 + a, " " if a == b == c == d else "▕" if a == b == c else "▐" if a == b and c == d else "?"))
                 else:
-                    self.output.write("\033[{};{}m".format(30 + a, 40 + d))
-                    self.output.write("█" if a == b == c == d else "▉" if a == b == c else "▌" if a == b and c == d else "▍" if b == c == d else "?")
-            self.output.write("\033[0m")
-        self.output.flush()
+                    line.append((30 + a, 40 + d, "█" if a == b == c == d else "▉" if a == b == c else "▌" if a == b and c == d else "▍" if b == c == d else "?"))
+            cells.append(line)
+        self.frames[h] = cells
+        return cells
+
+    def runs(self, cells: Cells, spans: list[tuple[int, int, int]]) -> str:
+        """Escape sequences drawing the columns `start` to `stop` of the rows of `spans`, given as (row, start, stop)."""
+        W, B, U, D, T, L = self.args
+        parts = list[str]()
+        for i, start, stop in spans:
+            parts.append("\033[{};{}H".format(T + i + 1, L + start + 1))
+            color = None
+            for fg, bg, char in cells[i][start:stop]:
+                if (fg, bg) != color:
+                    parts.append("\033[{};{}m".format(fg, bg))
+                    color = fg, bg
+                parts.append(char)
+        parts.append("\033[0m")
+        return "".join(parts)
+
+    def full(self, h: int | None) -> str:
+        cells = self.cells(h)
+        return "\033[2J" + self.runs(cells, [(i, 0, len(row)) for i, row in enumerate(cells)])
+
+    def diff(self, old: int | None, new: int | None) -> str:
+        """Escape sequences turning the keyboard highlighting `old` into the one highlighting `new`."""
+        key = old, new
+        if key not in self.diffs:
+            before, after = self.cells(old), self.cells(new)
+            spans = list[tuple[int, int, int]]()
+            for i, (was, now) in enumerate(zip(before, after)):
+                changed = [j for j, (x, y) in enumerate(zip(was, now)) if x != y]
+                if changed:
+                    spans.append((i, changed[0], changed[-1] + 1))
+            self.diffs[key] = self.runs(after, spans)
+        return self.diffs[key]
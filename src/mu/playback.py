@@ -0,0 +1,210 @@
+import sys
+import threading
+import time
+from contextlib import AbstractContextManager, contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Callable, Iterable, Iterator
+
+import numpy as np
+
+
+# Return flags of stream callbacks, as defined by PyAudio
+CONTINUE = 0
+COMPLETE = 1
+
+Callback = Callable[[bytes | None, int, Any, int], tuple[bytes, int]]
+
+# Opens a stream of sample rate, sample width and frames per buffer, feeding it from a callback
+Opener = Callable[[int, int, int, Callback], AbstractContextManager[Any]]
+
+
+@dataclass
+class RingBuffer:
+    """
+    Ring of bytes shared by one producer and one consumer, without locks.
+
+    `head` counts the bytes ever written and `tail` those ever read. Each is
+    only advanced by its own side, once the bytes are copied, so either side
+    sees the other one's bytes complete.
+    """
+
+    size: int
+    data: np.ndarray = field(init=False)
+    head: int = 0
+    tail: int = 0
+
+    def __post_init__(self) -> None:
+        self.data = np.zeros(self.size, dtype=np.uint8)
+
+    def used(self) -> int:
+        return self.head - self.tail
+
+    def free(self) -> int:
+        return self.size - self.used()
+
+    def write(self, chunk: bytes | memoryview) -> int:
+        """Write as much of `chunk` as fits, and return how much it was."""
+        count = min(len(chunk), self.free())
+        src = np.frombuffer(chunk, dtype=np.uint8, count=count)
+        start = self.head % self.size
+        first = min(count, self.size - start)
+        self.data[start : start + first] = src[:first]
+        self.data[: count - first] = src[first:]
+        self.head += count
+        return count
+
+    def read(self, count: int) -> bytes:
+        """Read at most `count` bytes."""
+        count = min(count, self.used())
+        start = self.tail % self.size
+        first = min(count, self.size - start)
+        chunk = self.data[start : start + first].tobytes() + self.data[: count - first].tobytes()
+        self.tail += count
+        return chunk
+
+
+@dataclass
+class Player:
+    """
+    Feeds an audio stream in callback mode from blocks synthesized ahead of time.
+
+    A producer thread pulls `blocks` into a ring buffer of `latency` seconds,
+    as far ahead of the stream as it holds, while the stream callback drains it
+    `frames` frames at a time. Whenever the ring runs dry before the producer
+    is done, the callback plays silence instead and counts an underrun.
+    """
+
+    blocks: Iterable[bytes]
+    sr: int
+    sw: int
+    latency: float = 0.2
+    frames: int = 1024
+    # frames handed over to the stream so far, and the number of times it had to wait
+    played: int = 0
+    underruns: int = 0
+    # largest number of frames waiting in the ring, as seen by the stream
+    peak: int = 0
+    ring: RingBuffer = field(init=False)
+    done: threading.Event = field(init=False, default_factory=threading.Event)
+    thread: threading.Thread = field(init=False)
+
+    def __post_init__(self) -> None:
+        self.ring = RingBuffer(max(int(self.latency * self.sr), 2 * self.frames) * self.sw)
+        self.thread = threading.Thread(target=self.produce, daemon=True)
+
+    def start(self) -> None:
+        """Start the producer, and wait for it to fill the ring or be done."""
+        self.thread.start()
+        while self.ring.free() >= self.frames * self.sw and not self.done.wait(self.frames / self.sr / 4):
+            pass
+
+    def run(self, stream: Any, tick: Callable[[int], None] | None = None, interval: float = 0.01) -> None:
+        """Play through `stream` until it is over, calling `tick` with the frames played every `interval` seconds."""
+        self.start()
+        stream.start_stream()
+        while stream.is_active():
+            if tick is not None:
+                tick(self.played)
+            time.sleep(interval)
+
+    def produce(self) -> None:
+        try:
+            for block in self.blocks:
+                view = memoryview(block)
+                while view:
+                    view = view[self.ring.write(view) :]
+                    if view:
+                        time.sleep(self.frames / self.sr / 4)
+        finally:
+            self.done.set()
+
+    def buffered(self) -> float:
+        """Seconds of audio waiting in the ring."""
+        return self.ring.used() / self.sw / self.sr
+
+    def callback(self, in_data: bytes | None, frame_count: int, time_info: Any, status: int) -> tuple[bytes, int]:
+        size = frame_count * self.sw
+        finished = self.done.is_set()
+        self.peak = max(self.peak, self.ring.used() // self.sw)
+        chunk = self.ring.read(size)
+        self.played += len(chunk) // self.sw
+        if len(chunk) < size:
+            if not finished:
+                self.underruns += 1
+            chunk += (b"\x80" if self.sw == 1 else b"\x00") * (size - len(chunk))
+        if finished and self.ring.used() == 0:
+            return chunk, COMPLETE
+        return chunk, CONTINUE
+
+
+class FakeStream:
+    """
+    Stands in for a PyAudio output stream in callback mode, without any device.
+
+    The callback is called from a thread of its own, `speed` times as fast as
+    real time, and everything it returns is kept in `output`. The speed is
+    to be positive, the producer of a `Player` needing time to keep up.
+    """
+
+    def __init__(self, sr: int, frames: int, callback: Callback, speed: float = 1.0):
+        if not speed > 0:
+            raise ValueError("the speed must be positive")
+        self.sr = sr
+        self.frames = frames
+        self.callback = callback
+        self.speed = speed
+        self.output = bytearray()
+        self.active = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self) -> None:
+        while self.active:
+            chunk, flag = self.callback(None, self.frames, None, 0)
+            self.output += chunk
+            if flag != CONTINUE:
+                self.active = False
+            else:
+                time.sleep(self.frames / self.sr / self.speed)
+
+    def start_stream(self) -> None:
+        self.active = True
+        self.thread.start()
+
+    def is_active(self) -> bool:
+        return self.active
+
+    def stop_stream(self) -> None:
+        self.active = False
+        if self.thread.is_alive() and self.thread is not threading.current_thread():
+            self.thread.join()
+
+    def close(self) -> None:
+        self.stop_stream()
+
+
+@contextmanager
+def open_stream(sr: int, sw: int, frames: int, callback: Callback) -> Iterator[Any]:
+    """Open a PyAudio output stream in callback mode, or yield None if it is not installed."""
+    try:
+        from pyaudio import PyAudio  # type: ignore
+    except ImportError:
+        print("pyaudio is not installed; cannot play audio.", file=sys.stderr)
+        yield None
+        return
+    pa = PyAudio()
+    stream = pa.open(format=pa.get_format_from_width(sw), channels=1, rate=sr, output=True, frames_per_buffer=frames, stream_callback=callback, start=False)
+    try:
+        yield stream
+    finally:
+        stream.stop_stream()
+        stream.close()
+        pa.terminate()
+
+
+@contextmanager
+def open_fake_stream(sr: int, sw: int, frames: int, callback: Callback, speed: float = 1.0) -> Iterator[FakeStream]:
+    stream = FakeStream(sr, frames, callback, speed)
+    try:
+        yield stream
+    finally:
+        stream.close()
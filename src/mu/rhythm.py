@@ -0,0 +1,69 @@
+import math
+from typing import Sequence
+
+from . import ast
+
+
+# A timed note, with the fraction of a whole note it lasts as a numerator and
+# a denominator, unreduced, the latter being a power of 2 times the numerators
+# of the ratios around the note
+Timing = tuple[ast.TimedNote, int, int]
+
+# Numerator and denominator of the fraction of its undashed form that a note
+# of `und` underlines and `dot` dots lasts, 2 - 1/2^dot halved `und` times
+DASHES: dict[tuple[int, int], tuple[int, int]] = {}
+
+
+# Bound of the numerators and denominators of the durations a `ToneTable` stores exactly, in its 64-bit columns
+EXACT = 2**63
+
+
+def exact(num: int, den: int, ticks: int) -> bool:
+    """Whether the durations of a passage of `ticks` ticks in all, each lasting `num` / `den` seconds, are sure to be stored exactly."""
+    return max(den, ticks * num) < EXACT
+
+
+def dashes(und: int, dot: int) -> tuple[int, int]:
+    scale = DASHES.get((und, dot))
+    if scale is None:
+        scale = DASHES[und, dot] = 2 ** (dot + 1) - 1, 2 ** (und + dot)
+    return scale
+
+
+def timings(elements: Sequence[ast.Element]) -> list[Timing]:
+    """Every timed note of `elements`, in order, with the fraction of a whole note it lasts."""
+    result: list[Timing] = []
+    # elements left to visit at every level of nesting, with the fraction of a whole note an undashed note lasts there
+    stack = [(iter(elements), 1, 4)]
+    while stack:
+        items, num, den = stack[-1]
+        for element in items:
+            if isinstance(element, ast.TimedNote):
+                n, d = dashes(element.time.und, element.time.dot)
+                result.append((element, num * n, den * d))
+            elif isinstance(element, ast.Rated):
+                rat = element.ratio
+                rtd = rat.d if rat.d is not None else 2 ** (rat.n.bit_length() - 1)
+                stack.append((iter((element.inner,)), num * rtd, den * rat.n))
+                break
+            elif isinstance(element, ast.Angled):
+                stack.append((iter(element.inners), num, den * 2))
+                break
+            elif isinstance(element, ast.Braced):
+                stack.append((iter(element.inners), num, den))
+                break
+        else:
+            stack.pop()
+    return result
+
+
+def resolution(measures: list[list[Timing]]) -> tuple[int, dict[int, int]]:
+    """
+    Least number of ticks to a whole note in which every note of `measures` lasts a whole number of them.
+
+    Returns it along with the number of ticks a note lasts per unit of its
+    numerator, for each of the denominators.
+    """
+    dens = {den for timings in measures for _, _, den in timings}
+    res = math.lcm(*dens)
+    return res, {den: res // den for den in dens}
@@ -0,0 +1,330 @@
+import argparse
+import asyncio
+import hashlib
+import io
+import json
+import multiprocessing
+import sys
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field, fields
+from http import HTTPStatus
+from pathlib import Path
+from typing import Any, TextIO
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+
+from .parser import TextSource, TextBuffer, ParserError, parse_music
+from .converter import flatten_voices
+from .audio import AudioSettings, FUNCS
+from .oscillator import BANKS
+from .cache import WaveCache
+from . import wav
+
+
+# Largest score accepted, in bytes
+MAX_BODY = 1 << 20
+
+# Bytes of a response written at a time
+CHUNK = 1 << 16
+
+# Number of the latest requests latency metrics are computed over
+WINDOW = 1024
+
+# Highest sample rate, and longest attack and decay in seconds, accepted
+MAX_SR = 192000
+MAX_ENVELOPE = 10.0
+
+
+class RenderError(Exception):
+    """A score that cannot be rendered, with the reason why, as raised in a worker."""
+
+
+class TooLong(RenderError):
+    """A score that would play for longer than the server renders."""
+
+
+@dataclass(frozen=True)
+class Params:
+    """Parameters of a render, as given in the query string of a request."""
+
+    timbre: str = next(iter(FUNCS))
+    attack: float = 0.02
+    decay: float = 0.02
+    volume: float = 0.8
+    sr: int = 44100
+    sw: int = 2
+    wavetable: bool = False
+
+    @classmethod
+    def from_query(cls, query: str) -> "Params":
+        values: dict[str, Any] = {}
+        types = {f.name: f.type for f in fields(cls)}
+        for name, [value, *_] in parse_qs(query).items():
+            if name not in types:
+                raise ValueError(f"unknown parameter {name!r}")
+            kind = types[name]
+            try:
+                values[name] = value in ("1", "true") if kind is bool else kind(value)
+            except ValueError:
+                raise ValueError(f"invalid value {value!r} of {name!r}") from None
+        params = cls(**values)
+        if params.timbre not in FUNCS:
+            raise ValueError(f"unknown timbre {params.timbre!r}")
+        if params.sw not in (1, 2):
+            raise ValueError("the sample width must be 1 or 2")
+        if not 0 < params.sr <= MAX_SR:
+            raise ValueError(f"the sample rate must be positive and at most {MAX_SR}")
+        if not (0 < params.attack <= MAX_ENVELOPE and 0 < params.decay <= MAX_ENVELOPE):
+            raise ValueError(f"the attack and decay must be positive and at most {MAX_ENVELOPE} seconds")
+        if not 0 <= params.volume <= 1:
+            raise ValueError("the volume must be between 0 and 1")
+        return params
+
+    def settings(self, cache: WaveCache | None = None) -> AudioSettings:
+        return AudioSettings(
+            func=FUNCS[self.timbre],
+            attack=self.attack,
+            decay=self.decay,
+            volume=self.volume,
+            sr=self.sr,
+            sw=self.sw,
+            bank=BANKS[self.timbre] if self.wavetable else None,
+            cache=cache,
+        )
+
+
+# waveform cache of the worker process, kept from one render to the next
+cache: WaveCache | None = None
+
+
+def init(budget: int) -> None:
+    global cache
+    cache = WaveCache(budget=budget) if budget > 0 else None
+
+
+def render(text: str, params: Params, max_seconds: float) -> bytes:
+    """
+    The WAV file of the score `text`, as `mu -o` would save it.
+
+    Its length is worked out from the tones before anything is synthesized,
+    so that a score playing for longer than `max_seconds` is refused without
+    allocating its samples.
+    """
+    settings = params.settings(cache)
+    try:
+        voices = flatten_voices(parse_music(TextBuffer(TextSource(name="score", text=text))), io.StringIO())
+    except ParserError as e:
+        raise RenderError(str(e)) from None
+    frames = settings.count_frames(voices)
+    if frames > max_seconds * settings.sr:
+        raise TooLong(f"the score plays for {frames / settings.sr:.0f} seconds, longer than the {max_seconds:g} rendered at most")
+    buffer = settings.mix(voices) if len(voices) > 1 else None
+    head = wav.header(settings.sr, settings.sw, frames)
+    data = bytearray(len(head) + frames * settings.sw)
+    data[: len(head)] = head
+    out = np.frombuffer(data, dtype=np.uint8)[len(head) :]
+    if buffer is not None:
+        settings.quantize_into(buffer, out)
+    else:
+        settings.render_into(voices[0], out)
+    return bytes(data)
+
+
+@dataclass
+class Results:
+    """Least recently used cache of rendered files, holding at most `budget` bytes."""
+
+    budget: int
+    hits: int = 0
+    misses: int = 0
+    size: int = 0
+    entries: OrderedDict[str, bytes] = field(default_factory=lambda: OrderedDict())
+
+    def get(self, key: str) -> bytes | None:
+        data = self.entries.get(key)
+        if data is None:
+            self.misses += 1
+        else:
+            self.entries.move_to_end(key)
+            self.hits += 1
+        return data
+
+    def put(self, key: str, data: bytes) -> None:
+        if len(data) > self.budget:
+            return
+        self.entries[key] = data
+        self.size += len(data)
+        while self.size > self.budget:
+            _, old = self.entries.popitem(last=False)
+            self.size -= len(old)
+
+
+@dataclass
+class Server:
+    """
+    Renders scores posted over HTTP, in a pool of `jobs` worker processes.
+
+    `POST /render` takes the score as its body and the parameters of `Params`
+    in its query string, and answers with the WAV file. Results are cached by
+    the digest of the score and the parameters, and a request for a render
+    already under way waits for that one rather than starting another.
+    Scores playing for longer than `max_seconds` are refused. Should a worker
+    die, the pool is started anew, each worker with a waveform cache of
+    `budget` bytes. `GET /metrics` answers with counters, the depth of the
+    queue of the pool, and the latencies of the latest requests, as JSON.
+    """
+
+    jobs: int
+    results: Results
+    budget: int
+    max_seconds: float
+    pool: ProcessPoolExecutor = field(init=False)
+    pending: dict[str, asyncio.Future[bytes]] = field(default_factory=lambda: {})
+    requests: int = 0
+    failures: int = 0
+    coalesced: int = 0
+    rendering: int = 0
+    restarts: int = 0
+    latencies: deque[float] = field(default_factory=lambda: deque(maxlen=WINDOW))
+
+    def __post_init__(self) -> None:
+        # workers forked from the server would inherit the sockets of the connections open at the time, and keep them open
+        method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        self.pool = ProcessPoolExecutor(max_workers=self.jobs, mp_context=multiprocessing.get_context(method), initializer=init, initargs=(self.budget,))
+
+    def restart(self, broken: ProcessPoolExecutor) -> None:
+        """Replace the pool `broken`, unless that was done already for another of its renders."""
+        if self.pool is broken:
+            broken.shutdown(wait=False, cancel_futures=True)
+            self.__post_init__()
+            self.restarts += 1
+
+    async def render(self, text: str, params: Params) -> bytes:
+        key = hashlib.sha256(repr((text, params)).encode("utf-8")).hexdigest()
+        data = self.results.get(key)
+        if data is not None:
+            return data
+        if key in self.pending:
+            self.coalesced += 1
+            return await asyncio.shield(self.pending[key])
+        pool = self.pool
+        future = asyncio.get_running_loop().run_in_executor(pool, render, text, params, self.max_seconds)
+        self.pending[key] = future
+        self.rendering += 1
+        try:
+            data = await asyncio.shield(future)
+        except BrokenProcessPool:
+            self.restart(pool)
+            raise
+        finally:
+            self.rendering -= 1
+            del self.pending[key]
+        self.results.put(key, data)
+        return data
+
+    def metrics(self) -> dict[str, Any]:
+        latencies = np.array(self.latencies) * 1000
+        return {
+            "requests": self.requests,
+            "failures": self.failures,
+            "coalesced": self.coalesced,
+            "rendering": self.rendering,
+            "restarts": self.restarts,
+            "queue_depth": max(self.rendering - self.jobs, 0),
+            "cache": {"hits": self.results.hits, "misses": self.results.misses, "entries": len(self.results.entries), "bytes": self.results.size},
+            "latency_ms": {
+                "count": len(latencies),
+                "mean": float(latencies.mean()) if len(latencies) else None,
+                "p50": float(np.percentile(latencies, 50)) if len(latencies) else None,
+                "p95": float(np.percentile(latencies, 95)) if len(latencies) else None,
+                "max": float(latencies.max()) if len(latencies) else None,
+            },
+        }
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        begin = time.perf_counter()
+        try:
+            status, kind, body = await self.respond(reader)
+        except (asyncio.IncompleteReadError, ConnectionError, UnicodeDecodeError, ValueError):
+            status, kind, body = HTTPStatus.BAD_REQUEST, "text/plain; charset=utf-8", b"malformed request\n"
+        except Exception:
+            # a worker running out of memory or dying, say, which is still to be answered and counted
+            status, kind, body = HTTPStatus.INTERNAL_SERVER_ERROR, "text/plain; charset=utf-8", b"render failed\n"
+        try:
+            writer.write(f"HTTP/1.1 {status.value} {status.phrase}\r\nContent-Type: {kind}\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("latin-1"))
+            for start in range(0, len(body), CHUNK):
+                writer.write(body[start : start + CHUNK])
+                await writer.drain()
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+        self.requests += 1
+        if status != HTTPStatus.OK:
+            self.failures += 1
+        self.latencies.append(time.perf_counter() - begin)
+
+    async def respond(self, reader: asyncio.StreamReader) -> tuple[HTTPStatus, str, bytes]:
+        method, target, _ = (await reader.readline()).decode("latin-1").split(" ", 2)
+        headers: dict[str, str] = {}
+        while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        url = urlsplit(target)
+        if url.path == "/metrics" and method == "GET":
+            return HTTPStatus.OK, "application/json", json.dumps(self.metrics()).encode("utf-8")
+        if url.path != "/render":
+            return HTTPStatus.NOT_FOUND, "text/plain; charset=utf-8", b"not found\n"
+        if method != "POST":
+            return HTTPStatus.METHOD_NOT_ALLOWED, "text/plain; charset=utf-8", b"scores are to be posted\n"
+        length = int(headers.get("content-length", "0"))
+        if length > MAX_BODY:
+            return HTTPStatus.REQUEST_ENTITY_TOO_LARGE, "text/plain; charset=utf-8", b"score too large\n"
+        text = (await reader.readexactly(length)).decode("utf-8")
+        try:
+            params = Params.from_query(url.query)
+            data = await self.render(text, params)
+        except TooLong as e:
+            return HTTPStatus.REQUEST_ENTITY_TOO_LARGE, "text/plain; charset=utf-8", f"{e}\n".encode("utf-8")
+        except (ValueError, RenderError) as e:
+            return HTTPStatus.BAD_REQUEST, "text/plain; charset=utf-8", f"{e}\n".encode("utf-8")
+        return HTTPStatus.OK, "audio/wav", data
+
+
+async def serve(server: Server, host: str, port: int, unix: Path | None, log: TextIO = sys.stderr) -> None:
+    if unix is not None:
+        listener = await asyncio.start_unix_server(server.handle, path=unix)
+        log.write(f"Serving on {unix}\n")
+    else:
+        listener = await asyncio.start_server(server.handle, host, port)
+        log.write(f"Serving on http://{host}:{port}\n")
+    async with listener:
+        await listener.serve_forever()
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(prog="mu serve", description="Render scores posted over HTTP, without starting a process per score")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="address to listen on")
+    parser.add_argument("-p", "--port", type=int, default=8737, help="port to listen on")
+    parser.add_argument("-u", "--unix", type=Path, default=None, help="unix socket to listen on instead of a port")
+    parser.add_argument("-j", "--jobs", type=int, default=2, help="number of processes to render scores with")
+    parser.add_argument("-c", "--cache-size", type=float, default=64, help="memory budget of the note waveform cache of each worker in MiB, 0 to disable it")
+    parser.add_argument("-R", "--results-size", type=float, default=256, help="memory budget of the cache of rendered files in MiB")
+    parser.add_argument("-m", "--max-seconds", type=float, default=600, help="longest a score may play for to be rendered, in seconds")
+    args = parser.parse_args(argv)
+    if args.jobs < 1:
+        parser.error("the number of jobs must be at least 1")
+    if not args.max_seconds > 0:
+        parser.error("the longest a score may play for must be positive")
+    server = Server(jobs=args.jobs, results=Results(budget=int(args.results_size * 2**20)), budget=int(args.cache_size * 2**20), max_seconds=args.max_seconds)
+    try:
+        asyncio.run(serve(server, args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.pool.shutdown()
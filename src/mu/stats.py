@@ -0,0 +1,163 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import AbstractContextManager, contextmanager, nullcontext
+from dataclasses import dataclass, field
+from typing import Any, Callable, Generator, Iterable, Iterator, TypeVar
+
+
+T = TypeVar("T")
+
+
+@dataclass
+class Span:
+    """A stage of the pipeline as it ran once: when it started, and how much wall and CPU time it took, in seconds."""
+
+    name: str
+    args: dict[str, Any]
+    start: float
+    wall: float = 0.0
+    cpu: float = 0.0
+    thread: int = 0
+
+
+Hook = Callable[[Span], None]
+
+
+@dataclass
+class Stats:
+    """
+    Time spent in every stage of the pipeline, and counts of what went through it.
+
+    Stages are timed while the stats are being `collect`ed, and every span is
+    passed to each of `hooks` as soon as it ends. CPU time is that of the whole
+    process, so it includes the producer thread of playback and the like, but
+    not the worker processes of `-j`, whose stage is timed as a whole.
+    """
+
+    hooks: list[Hook] = field(default_factory=lambda: [])
+    spans: list[Span] = field(default_factory=lambda: [])
+    counts: Counter[str] = field(default_factory=lambda: Counter())
+    origin: float = field(default_factory=time.perf_counter)
+    wall: float = 0.0
+    cpu: float = 0.0
+
+    @contextmanager
+    def stage(self, name: str, args: dict[str, Any]) -> Iterator[Span]:
+        span = Span(name, args, time.perf_counter() - self.origin, thread=threading.get_ident())
+        cpu = time.process_time()
+        try:
+            yield span
+        finally:
+            span.wall = time.perf_counter() - self.origin - span.start
+            span.cpu = time.process_time() - cpu
+            self.end(span)
+
+    def timed(self, name: str, items: Iterable[T], args: dict[str, Any]) -> Generator[T, None, Any]:
+        span = Span(name, args, time.perf_counter() - self.origin, thread=threading.get_ident())
+        iterator = iter(items)
+        try:
+            while True:
+                wall, cpu = time.perf_counter(), time.process_time()
+                try:
+                    item = next(iterator)
+                finally:
+                    span.wall += time.perf_counter() - wall
+                    span.cpu += time.process_time() - cpu
+                yield item
+        except StopIteration as stop:
+            return stop.value
+        finally:
+            self.end(span)
+
+    def end(self, span: Span) -> None:
+        self.spans.append(span)
+        for hook in self.hooks:
+            hook(span)
+
+    def report(self) -> dict[str, Any]:
+        """Totals of every stage, grouped by name and arguments, in the order they first ran, along with the counts."""
+        stages: dict[tuple[str, str], dict[str, Any]] = {}
+        for span in self.spans:
+            key = span.name, repr(sorted(span.args.items()))
+            if key not in stages:
+                stages[key] = {"name": span.name, **span.args, "calls": 0, "wall_secs": 0.0, "cpu_secs": 0.0}
+            stages[key]["calls"] += 1
+            stages[key]["wall_secs"] += span.wall
+            stages[key]["cpu_secs"] += span.cpu
+        return {
+            "wall_secs": self.wall,
+            "cpu_secs": self.cpu,
+            "peak_rss_mib": peak_rss(),
+            "stages": list(stages.values()),
+            "counts": dict(self.counts),
+        }
+
+    def trace(self) -> dict[str, Any]:
+        """Every span as a complete event of the Chrome trace event format, for chrome://tracing or Perfetto."""
+        pid = os.getpid()
+        return {
+            "traceEvents": [
+                {"name": span.name, "ph": "X", "ts": span.start * 1e6, "dur": span.wall * 1e6, "pid": pid, "tid": span.thread, "args": {**span.args, "cpu_ms": span.cpu * 1e3}}
+                for span in self.spans
+            ],
+            "displayTimeUnit": "ms",
+        }
+
+
+# stats being collected, if any
+current: Stats | None = None
+
+NULL = nullcontext()
+
+
+@contextmanager
+def collect(stats: Stats | None) -> Iterator[Stats | None]:
+    """Time the stages run within into `stats`, or nothing if None."""
+    global current
+    if stats is None:
+        yield None
+        return
+    previous, current = current, stats
+    wall, cpu = time.perf_counter(), time.process_time()
+    try:
+        yield stats
+    finally:
+        stats.wall += time.perf_counter() - wall
+        stats.cpu += time.process_time() - cpu
+        current = previous
+
+
+def stage(name: str, **args: Any) -> AbstractContextManager[Any]:
+    """Time what is run within as a stage, if stats are being collected."""
+    if current is None:
+        return NULL
+    return current.stage(name, args)
+
+
+def timed(name: str, items: Iterable[T], **args: Any) -> Iterable[T]:
+    """
+    Time the pulling of `items` as a stage, if stats are being collected, leaving out what is done with them in between.
+
+    The value a generator returns is returned in turn.
+    """
+    if current is None:
+        return items
+    return current.timed(name, items, args)
+
+
+def count(name: str, n: int = 1) -> None:
+    if current is not None:
+        current.counts[name] += n
+
+
+def peak_rss() -> float | None:
+    """Peak resident set size of this process, in MiB, where it can be known."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
@@ -1,7 +1,200 @@
-from dataclasses import dataclass
+import math
+from dataclasses import dataclass, field
+from fractions import Fraction
+from itertools import islice
+from typing import Iterable, Iterator
+
+import numpy as np
+
+from .rhythm import EXACT
 
 
 @dataclass
 class Tone:
     pitch: int | None
-    secs: float = 0.0
+    secs: Fraction = Fraction(0)
+
+
+# Pitch of rests in a `ToneTable`
+REST = np.iinfo(np.int16).min
+
+# Largest denominator of the durations `fit` rounds, which are then off by less than a picosecond
+FINEST = 2**40
+
+
+def fit(secs: Fraction) -> Fraction:
+    """`secs`, or if it is too fine to be stored exactly in a `ToneTable`, the closest duration that is not."""
+    if secs.numerator < EXACT and secs.denominator < EXACT:
+        return secs
+    return secs.limit_denominator(min(FINEST, EXACT // (secs.numerator // secs.denominator + 1)))
+
+
+@dataclass
+class ToneTable:
+    """
+    Tones stored column by column.
+
+    Pitches are 16-bit, with `REST` for rests, and durations are exact, as the
+    numerators and denominators of their reduced fractions of seconds, unless
+    they overflow 64 bits, in which case they are rounded by `fit`. Columns
+    grow geometrically, so that tones can be appended one by one as cheaply as
+    in bulk, and are read through the trimmed `pitch`, `num` and `den`.
+    """
+
+    size: int = 0
+    _pitch: np.ndarray = field(default_factory=lambda: np.empty(0, dtype=np.int16))
+    _num: np.ndarray = field(default_factory=lambda: np.empty(0, dtype=np.int64))
+    _den: np.ndarray = field(default_factory=lambda: np.empty(0, dtype=np.int64))
+
+    @classmethod
+    def from_tones(cls, tones: Iterable[Tone]) -> "ToneTable":
+        table = cls()
+        table.extend(tones)
+        return table
+
+    @classmethod
+    def batches(cls, tones: "Iterable[Tone] | ToneTable", size: int = 1024) -> "Iterator[ToneTable]":
+        """Split `tones` into tables of at most `size` tones, pulled from `tones` only as they are needed."""
+        if isinstance(tones, ToneTable):
+            yield tones
+            return
+        it = iter(tones)
+        while batch := cls.from_tones(islice(it, size)):
+            yield batch
+
+    @property
+    def pitch(self) -> np.ndarray:
+        return self._pitch[: self.size]
+
+    @property
+    def num(self) -> np.ndarray:
+        return self._num[: self.size]
+
+    @property
+    def den(self) -> np.ndarray:
+        return self._den[: self.size]
+
+    @property
+    def secs(self) -> np.ndarray:
+        return self.num / self.den
+
+    @property
+    def freq(self) -> np.ndarray:
+        # computed in Python once per distinct pitch, whose `**` may round differently from NumPy's
+        pitches, inverse = np.unique(self.pitch, return_inverse=True)
+        return np.array([440.0 * 2 ** (p / 12) if p != REST else 0.0 for p in pitches.tolist()])[inverse]
+
+    def reserve(self, size: int) -> None:
+        if size > len(self._pitch):
+            size = max(size, 2 * len(self._pitch))
+            self._pitch = np.resize(self._pitch, size)
+            self._num = np.resize(self._num, size)
+            self._den = np.resize(self._den, size)
+
+    def append(self, tone: Tone) -> None:
+        self.reserve(self.size + 1)
+        secs = fit(Fraction(tone.secs))
+        self._pitch[self.size] = tone.pitch if tone.pitch is not None else REST
+        self._num[self.size] = secs.numerator
+        self._den[self.size] = secs.denominator
+        self.size += 1
+
+    def extend(self, tones: "Iterable[Tone] | ToneTable") -> None:
+        if isinstance(tones, ToneTable):
+            self.reserve(self.size + tones.size)
+            self._pitch[self.size : self.size + tones.size] = tones.pitch
+            self._num[self.size : self.size + tones.size] = tones.num
+            self._den[self.size : self.size + tones.size] = tones.den
+            self.size += tones.size
+        else:
+            for tone in tones:
+                self.append(tone)
+
+    def total(self) -> Fraction:
+        """Exact sum of the durations."""
+        num, den = self.num, self.den
+        return sum((Fraction(int(num[den == d].sum()), int(d)) for d in np.unique(den)), Fraction(0))
+
+    def edges(self, sr: int, onset: Fraction = Fraction(0)) -> np.ndarray:
+        """
+        Frames at which the tones start, then the one at which the last ends, from that of `onset` on.
+
+        Onsets are summed exactly, over the least common multiple of the
+        denominators, unless that might overflow, in which case they are summed
+        as fractions one by one.
+        """
+        num, den = self.num, self.den
+        dens = np.unique(den).tolist()
+        lcm = math.lcm(onset.denominator, *dens)
+        base = onset.numerator * (lcm // onset.denominator)
+        bound = abs(base) + sum(int(num[den == d].sum()) * (lcm // d) for d in dens)
+        if max(bound, lcm) * sr < 2**63:
+            ticks = np.empty(self.size + 1, dtype=np.int64)
+            ticks[0] = base
+            np.cumsum(num * (lcm // den), out=ticks[1:])
+            ticks[1:] += base
+            ticks *= sr
+            return ticks // lcm - base * sr // lcm
+        edges = np.empty(self.size + 1, dtype=np.int64)
+        start = math.floor(onset * sr)
+        for i, (n, d) in enumerate(zip(num.tolist(), den.tolist())):
+            edges[i] = math.floor(onset * sr) - start
+            onset += Fraction(n, d)
+        edges[self.size] = math.floor(onset * sr) - start
+        return edges
+
+    def common(self, other: "ToneTable") -> tuple[int, int]:
+        """Numbers of tones at the start, then at the end, that are the same in `other`, without overlapping."""
+        size = min(self.size, other.size)
+        head = np.ones(size, dtype=bool)
+        tail = np.ones(size, dtype=bool)
+        for mine, theirs in (self.pitch, other.pitch), (self.num, other.num), (self.den, other.den):
+            head &= mine[:size] == theirs[:size]
+            tail &= mine[self.size - size :] == theirs[other.size - size :]
+        lead = int(np.argmin(head)) if not head.all() else size
+        trail = int(np.argmin(tail[::-1])) if not tail.all() else size
+        return lead, min(trail, size - lead)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __bool__(self) -> bool:
+        return self.size > 0
+
+    def __iter__(self) -> "Iterator[ToneView]":
+        return (ToneView(self, i) for i in range(self.size))
+
+    def __getitem__(self, key: int | slice) -> "ToneView | ToneTable":
+        if isinstance(key, slice):
+            pitch = self.pitch[key].copy()
+            return ToneTable(len(pitch), pitch, self.num[key].copy(), self.den[key].copy())
+        if not -self.size <= key < self.size:
+            raise IndexError(key)
+        return ToneView(self, key % self.size)
+
+
+@dataclass
+class ToneView:
+    """A row of a `ToneTable`, read and written like a `Tone`."""
+
+    table: ToneTable
+    index: int
+
+    @property
+    def pitch(self) -> int | None:
+        pitch = int(self.table._pitch[self.index])
+        return pitch if pitch != REST else None
+
+    @pitch.setter
+    def pitch(self, pitch: int | None) -> None:
+        self.table._pitch[self.index] = pitch if pitch is not None else REST
+
+    @property
+    def secs(self) -> Fraction:
+        return Fraction(int(self.table._num[self.index]), int(self.table._den[self.index]))
+
+    @secs.setter
+    def secs(self, secs: Fraction) -> None:
+        secs = Fraction(secs)
+        self.table._num[self.index] = secs.numerator
+        self.table._den[self.index] = secs.denominator
@@ -0,0 +1,169 @@
+import io
+import math
+import sys
+import struct
+import time
+import wave
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import TextIO
+
+from . import ast
+from .parser import TextSource, TextBuffer, ParserError, parse_music
+from .converter import Memo, index, convert, flatten_voices
+from .audio import AudioSettings
+from .tone import ToneTable
+
+
+@dataclass
+class Converted:
+    mod: ast.Mode
+    mtr: ast.Metre
+    bmp: int
+    passage: ast.Passage
+    tones: ToneTable
+    warnings: str
+
+
+@dataclass
+class Rendition:
+    """
+    The last rendering of a score, kept to render its next version incrementally.
+
+    Passages are only converted again when they or the header of their group
+    change. The tones of the new version are then compared to those of the old
+    one, and only those between the longest common prefix and suffix are
+    synthesized again. The suffix is moved rather than synthesized again, as
+    long as its onset falls at the same fraction of a frame as before.
+    """
+
+    settings: AudioSettings
+    passages: dict[int, Converted] = field(default_factory=lambda: {})
+    tones: ToneTable = field(default_factory=lambda: ToneTable())
+    pcm: bytearray = field(default_factory=lambda: bytearray())
+
+    def flatten(self, music: ast.Music, output: TextIO = sys.stderr) -> ToneTable:
+        """Same as `converter.flatten`, reusing the passages converted last time."""
+        passages: dict[int, Converted] = {}
+        memo: Memo = {}
+        for i, (group, passage) in index(music).items():
+            old = self.passages.get(i)
+            if old is None or (old.mod, old.mtr, old.bmp, old.passage) != (group.mod, group.mtr, group.bmp, passage):
+                log = io.StringIO()
+                old = Converted(group.mod, group.mtr, group.bmp, passage, ToneTable.from_tones(convert(i, group, passage, log, memo)), log.getvalue())
+            output.write(old.warnings)
+            passages[i] = old
+        self.passages = passages
+
+        if music.final is not None:
+            nums = music.final
+        else:
+            nums = passages.keys()
+
+        tones = ToneTable()
+        for num in nums:
+            if num not in passages:
+                output.write(f"Warning: Passage {num} not found, skipping\n")
+            else:
+                tones.extend(passages[num].tones)
+
+        return tones
+
+    def update(self, tones: ToneTable) -> tuple[int, int, bool]:
+        """
+        Render `tones` in place of the previous ones.
+
+        Returns the range of bytes of the PCM that changed, and whether its size did.
+        """
+        sr, sw = self.settings.sr, self.settings.sw
+        head, tail = self.tones.common(tones)
+        if self.settings.bank is not None:
+            # the phase of the oscillators depends on everything played before
+            head = tail = 0
+        onset = tones[:head].total()
+        old = onset + self.tones[head : len(self.tones) - tail].total()
+        new = onset + tones[head : len(tones) - tail].total()
+        length = len(self.pcm)
+        start = math.floor(onset * sr) * sw
+        if tail and old * sr % 1 == new * sr % 1:
+            middle = b"".join(self.settings.stream(tones[head : len(tones) - tail], onset=onset))
+            self.pcm[start : math.floor(old * sr) * sw] = middle
+            stop = start + len(middle)
+        else:
+            self.pcm[start:] = b"".join(self.settings.stream(tones[head:], onset=onset))
+            stop = len(self.pcm)
+        self.tones = tones
+        resized = len(self.pcm) != length
+        return start, stop if not resized else len(self.pcm), resized
+
+
+def data_offset(path: Path) -> int:
+    """Offset of the samples in the WAV file at `path`."""
+    with path.open("rb") as file:
+        file.seek(12)
+        while True:
+            name, size = struct.unpack("<4sI", file.read(8))
+            if name == b"data":
+                return file.tell()
+            file.seek(size + size % 2, 1)
+
+
+def write(settings: AudioSettings, pcm: bytearray, output: Path) -> None:
+    with wave.open(output.as_posix(), "wb") as file:
+        file.setnchannels(1)
+        file.setsampwidth(settings.sw)
+        file.setframerate(settings.sr)
+        file.writeframes(pcm)
+
+
+def patch(pcm: bytearray, start: int, stop: int, resized: bool, output: Path) -> None:
+    """Write bytes `start` to `stop` of `pcm` over the samples of `output`, and its new size if `resized`."""
+    offset = data_offset(output)
+    with output.open("r+b") as file:
+        file.seek(offset + start)
+        file.write(pcm[start:stop])
+        if resized:
+            file.truncate(offset + len(pcm))
+            file.seek(offset - 4)
+            file.write(struct.pack("<I", len(pcm)))
+            file.seek(4)
+            file.write(struct.pack("<I", offset - 8 + len(pcm)))
+
+
+def refresh(rendition: Rendition, path: Path, output: Path, log: TextIO = sys.stderr) -> Rendition:
+    """Render `path` into `output` from `rendition`, and return the rendition to start from next time."""
+    begin = time.perf_counter()
+    settings = rendition.settings
+    try:
+        music = parse_music(TextBuffer(TextSource(name=path.name, text=path.read_text(encoding="utf-8"))), pause_gc=True)
+    except ParserError as e:
+        log.write(f"Error: {e}\n")
+        return rendition
+    if music.voices:
+        # voices are mixed and normalized as a whole, so they are rendered from scratch
+        settings.save_mix(flatten_voices(music, log), output)
+        log.write(f"Rendered {len(music.voices) + 1} voices in {(time.perf_counter() - begin) * 1000:.0f} ms\n")
+        return Rendition(settings)
+    fresh = not rendition.tones or not output.exists()
+    start, stop, resized = rendition.update(rendition.flatten(music, log))
+    if fresh:
+        write(settings, rendition.pcm, output)
+    else:
+        patch(rendition.pcm, start, stop, resized, output)
+    log.write(f"Rendered {(stop - start) // settings.sw} frames in {(time.perf_counter() - begin) * 1000:.0f} ms\n")
+    return rendition
+
+
+def watch(path: Path, output: Path, settings: AudioSettings, interval: float = 0.1, log: TextIO = sys.stderr) -> None:
+    """Render `path` into `output` again whenever it is modified, until interrupted."""
+    rendition = Rendition(settings)
+    mtime = None
+    while True:
+        try:
+            stat = path.stat().st_mtime_ns
+        except FileNotFoundError:
+            stat = None
+        if stat is not None and stat != mtime:
+            mtime = stat
+            rendition = refresh(rendition, path, output, log)
+        time.sleep(interval)
@@ -0,0 +1,93 @@
+import struct
+from contextlib import contextmanager
+from pathlib import Path
+from typing import BinaryIO, Iterator
+
+import numpy as np
+
+from . import stats
+
+
+# Largest RIFF chunk size, beyond which files are written as RF64
+RIFF_LIMIT = 2**32 - 1
+
+
+def header(sr: int, sw: int, frames: int) -> bytes:
+    """
+    Header of a mono PCM WAV file of `frames` frames, up to its data chunk.
+
+    Files whose RIFF chunk would overflow 32 bits are RF64 files, whose sizes
+    are given in a ds64 chunk instead, the 32-bit ones being left at their
+    largest value. Others are the same as those written by `wave`.
+    """
+    size = frames * sw
+    fmt = struct.pack("<4sIHHIIHH", b"fmt ", 16, 1, 1, sr, sr * sw, sw, sw * 8)
+    if 36 + size <= RIFF_LIMIT:
+        return struct.pack("<4sI4s", b"RIFF", 36 + size, b"WAVE") + fmt + struct.pack("<4sI", b"data", size)
+    ds64 = struct.pack("<4sIQQQI", b"ds64", 28, 72 + size, size, frames, 0)
+    return struct.pack("<4sI4s", b"RF64", RIFF_LIMIT, b"WAVE") + ds64 + fmt + struct.pack("<4sI", b"data", RIFF_LIMIT)
+
+
+@contextmanager
+def create(output: Path, sr: int, sw: int, frames: int) -> Iterator[np.ndarray]:
+    """Create a WAV file of `frames` frames at `output`, and map its samples into memory, as bytes to fill in."""
+    head = header(sr, sw, frames)
+    with output.open("wb") as file:
+        file.write(head)
+        file.truncate(len(head) + frames * sw)
+    with samples(output, len(head), frames * sw) as data:
+        yield data
+
+
+@contextmanager
+def stream(output: Path, sr: int, sw: int) -> Iterator[BinaryIO]:
+    """
+    Create a WAV file at `output` to write samples to one after the other, as many as there turn out to be.
+
+    Its header is written last, once the size of the samples is known. Should
+    the file need to be an RF64 one, the samples are moved forward to make
+    room for its longer header. The file is removed if writing fails.
+    """
+    start = len(header(sr, sw, 0))
+    try:
+        with output.open("w+b") as file:
+            file.write(bytes(start))
+            yield file
+            frames = (file.tell() - start) // sw
+            head = header(sr, sw, frames)
+            if len(head) > start:
+                shift(file, start, len(head) - start)
+            file.seek(0)
+            file.write(head)
+            stats.count("bytes", frames * sw)
+    except BaseException:
+        # a file without its header is of no use to anyone
+        output.unlink(missing_ok=True)
+        raise
+
+
+def shift(file: BinaryIO, start: int, by: int, chunk: int = 1 << 24) -> None:
+    """Move the bytes of `file` from `start` on `by` bytes forward, from the last ones back."""
+    end = file.seek(0, 2)
+    while end > start:
+        begin = max(start, end - chunk)
+        file.seek(begin)
+        data = file.read(end - begin)
+        file.seek(begin + by)
+        file.write(data)
+        end = begin
+
+
+@contextmanager
+def samples(output: Path, offset: int, size: int) -> Iterator[np.ndarray]:
+    """Map the `size` bytes of the WAV file at `output` from `offset` on into memory, and write them back once done."""
+    if size == 0:
+        yield np.empty(0, dtype=np.uint8)
+        return
+    data = np.memmap(output, dtype=np.uint8, mode="r+", offset=offset, shape=size)
+    try:
+        yield data
+    finally:
+        with stats.stage("write"):
+            data.flush()
+        stats.count("bytes", size)
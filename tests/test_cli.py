@@ -0,0 +1,39 @@
+import os
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from mu import cli
+
+
+EXAMPLES = Path(__file__).parent.parent / "examples"
+
+ENV = {**os.environ, "PYTHONPATH": os.pathsep.join([str(Path(__file__).parent.parent / "src"), os.environ.get("PYTHONPATH", "")])}
+
+
+def imported(*args: str) -> set[str]:
+    """Modules imported by a fresh interpreter run with `args`, as reported by -X importtime."""
+    run = subprocess.run([sys.executable, "-X", "importtime", *args], env=ENV, capture_output=True, text=True)
+    return {line.split("|")[-1].strip() for line in run.stderr.splitlines() if line.startswith("import time:")}
+
+
+def test_startup_without_numpy() -> None:
+    assert "numpy" not in imported("-c", "import mu.cli, mu.check")
+    assert "numpy" not in imported("-m", "mu", "check", str(EXAMPLES / "Wave.μ"))
+
+
+def test_compile(tmp_path: Path) -> None:
+    score = tmp_path / "score.μ"
+    shutil.copy(EXAMPLES / "Wave.μ", score)
+    cli.main(["compile", str(score)])
+    assert (tmp_path / "score.μc").exists()
+
+
+@pytest.mark.parametrize("command", cli.COMMANDS)
+def test_help(command: str) -> None:
+    with pytest.raises(SystemExit) as exit:
+        cli.main([command, "--help"])
+    assert exit.value.code == 0
@@ -0,0 +1,23 @@
+import io
+
+from mu.check import check
+from mu.parser import TextSource, TextBuffer, diagnose
+
+
+def diagnosed(text: str) -> tuple[list[str], str]:
+    music, errors = diagnose(TextBuffer(TextSource(name="score", text=text)))
+    log = io.StringIO()
+    check(music, log)
+    return [str(error) for error in errors], log.getvalue()
+
+
+def test_diagnose_last_group_before_order() -> None:
+    errors, warnings = diagnosed("1=G 4/4 130\n1 2 3 4 | 5 6 7 1 |\n;\n1=X 4/4 130\n1 2 3 4 | 5 6 7 1 |: 1 2 3\n")
+    assert errors == ["at row 4, col 3: expected one of {<A-G>}"]
+    assert warnings == "Warning: Passage 3 not found, skipping\n"
+
+
+def test_diagnose_keeps_numbers_past_skipped_group() -> None:
+    errors, warnings = diagnosed("1=X 4/4 120\n<6,5,> 1 2 |, 1 2 3 4 |;\n1=C 4/4 120\n1 2 3 |, 1 2 3 4 |: 1 2 3 4 5\n")
+    assert errors == ["at row 1, col 3: expected one of {<A-G>}"]
+    assert warnings == "Warning: Passage 3, Measure 1 has wrong time signature, expected 1, got 3/4\nWarning: Passage 5 not found, skipping\n"